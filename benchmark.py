@@ -0,0 +1,547 @@
+import argparse
+import contextlib
+import http.server
+import threading
+import urllib.error
+import urllib.request
+import io
+import json
+import platform
+import random
+import os
+import sys
+import tarfile
+import tempfile
+import time
+import tracemalloc
+
+import main
+""" Замеры производительности анализатора зависимостей.
+    Запуск: python benchmark.py > bench_output.txt
+    Набор по стадиям на синтетических репозиториях:
+        python benchmark.py suite --sizes 100 1000 10000 100000 --json bench.json
+        python benchmark.py suite --json new.json --compare bench.json
+"""
+
+
+def make_apkindex_text(graph, full_records=False):
+    """APKINDEX (поля P:/V:/D:) для графа
+    
+    full_records - добавить остальные поля настоящего APKINDEX (C:, A:, S:,
+    T:, p: и т.д.), чтобы записи были такого же размера, как в репозиториях Alpine.
+    """
+    blocks = []
+    for name, deps in graph.items():
+        block = f"P:{name}\nV:1.0-r0\n"
+        if full_records:
+            block = (f"C:Q1{name:0>27}=\n{block}A:x86_64\nS:123456\nI:456789\n"
+                     f"T:Synthetic package {name}\nU:https://example.org/{name}\nL:MIT\n"
+                     f"o:{name}\nm:Maintainer <maintainer@example.org>\nt:1700000000\n"
+                     f"c:0123456789abcdef0123456789abcdef01234567\n"
+                     f"p:so:lib{name}.so.1=1 cmd:{name}=1.0-r0\n")
+        if deps:
+            block += f"D:{' '.join(deps)}\n"
+        blocks.append(block)
+    return '\n'.join(blocks) + '\n'
+
+
+def make_synthetic_graph(count, fanout=4, depth=8, cycle_density=0.0, seed=1):
+    """Синтетический репозиторий из count пакетов в depth слоях
+    
+    Пакет слоя k зависит от 0..fanout пакетов из следующих слоёв (чаще из
+    соседнего, так что цепочки получаются глубиной около depth). С вероятностью
+    cycle_density пакет получает ещё и обратное ребро в более ранний слой - цикл.
+    Последним добавляется пакет 'world', зависящий от всего первого слоя.
+    """
+    rng = random.Random(seed)
+    depth = max(1, min(depth, count))
+    names = [f"pkg{i}" for i in range(count)]
+    # Пакеты слоя k - names[bounds[k]:bounds[k + 1]]
+    bounds = [count * k // depth for k in range(depth + 1)]
+
+    graph = {}
+    for layer in range(depth):
+        for i in range(bounds[layer], bounds[layer + 1]):
+            deps = set()
+            if layer + 1 < depth:
+                for _ in range(rng.randint(0, fanout)):
+                    target = layer + 1 + int(rng.random() ** 3 * (depth - layer - 1))
+                    deps.add(rng.randrange(bounds[target], bounds[target + 1]))
+            if layer and rng.random() < cycle_density:
+                deps.add(rng.randrange(0, bounds[layer]))
+            graph[names[i]] = [names[dep] for dep in sorted(deps)]
+
+    graph['world'] = names[bounds[0]:bounds[1]]
+    return graph
+
+
+def write_test_repo(graph, path):
+    """Файл в формате тестового репозитория (A:B C)"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for name, deps in graph.items():
+            f.write(f"{name}:{' '.join(deps)}\n")
+
+
+def write_apkindex_archive(graph, path):
+    """APKINDEX.tar.gz, как в настоящем репозитории"""
+    data = make_apkindex_text(graph).encode()
+    with tarfile.open(path, 'w:gz') as tar:
+        info = tarfile.TarInfo('APKINDEX')
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+
+def measure_memory(build):
+    """Сколько памяти держит результат build() (по tracemalloc)"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = build()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    return result, size
+
+
+def bench_graph_memory(count=50000, fanout=6):
+    print(f"=== Память графа: {count} пакетов, до {fanout} зависимостей ===")
+    graph = make_synthetic_graph(count, fanout, cycle_density=0.01)
+
+    # Как раньше: словарь со списками строк и словарь на каждый пакет
+    def build_dicts():
+        records = {
+            name: {'name': name, 'version': '1.0', 'depends': ' '.join(deps)}
+            for name, deps in graph.items()
+        }
+        adjacency = {name: [dep for dep in deps] for name, deps in graph.items()}
+        return records, adjacency
+
+    # Сейчас: PackageRecord со __slots__ и CSR
+    def build_compact():
+        records = {
+            name: main.PackageRecord(name, '1.0', ' '.join(deps))
+            for name, deps in graph.items()
+        }
+        compact = main.CompactGraph.from_dict(graph)
+        return records, compact
+
+    _, dict_size = measure_memory(build_dicts)
+    (_, compact), compact_size = measure_memory(build_compact)
+
+    print(f"dict + list:          {dict_size / 1024 / 1024:8.2f} МБ")
+    print(f"PackageRecord + CSR:  {compact_size / 1024 / 1024:8.2f} МБ")
+
+    start = time.perf_counter()
+    compact.strongly_connected_components()
+    print(f"SCC (Тарьян, CSR):    {time.perf_counter() - start:8.3f} с")
+
+    start = time.perf_counter()
+    compact.reverse()
+    print(f"Обратный граф:        {time.perf_counter() - start:8.3f} с\n")
+
+
+def bench_whole_repository(count=20000, sample=200):
+    print(f"=== Весь репозиторий: {count} пакетов ===")
+    text = make_apkindex_text(make_synthetic_graph(count))
+
+    start = time.perf_counter()
+    index = main.parse_apkindex(text)
+    compact = main.build_full_graph(index)
+    print(f"Разбор + граф:        {time.perf_counter() - start:8.3f} с")
+
+    start = time.perf_counter()
+    closures = main.compute_all_closures(compact)
+    elapsed = time.perf_counter() - start
+    print(f"Все замыкания (SCC):  {elapsed:8.3f} с")
+
+    # N отдельных BFS - меряем на выборке и пересчитываем на весь репозиторий
+    rng = random.Random(2)
+    names = rng.sample(compact.names, min(sample, len(compact)))
+    start = time.perf_counter()
+    for name in names:
+        compact.closure([compact.ids[name]])
+    per_package = (time.perf_counter() - start) / len(names)
+    print(f"N отдельных BFS:      {per_package * len(compact):8.3f} с (оценка по {len(names)} пакетам)")
+
+    total = sum(main.closure_size(closures, name) for name in compact.names)
+    print(f"Средний размер замыкания: {total / len(compact):.1f}\n")
+
+
+def bench_reverse_queries(count=50000, queries=500):
+    print(f"=== Обратные зависимости: {count} пакетов, {queries} запросов ===")
+    text = make_apkindex_text(make_synthetic_graph(count))
+
+    start = time.perf_counter()
+    index = main.parse_apkindex(text)
+    print(f"Разбор:               {time.perf_counter() - start:8.3f} с")
+
+    start = time.perf_counter()
+    main.get_reverse_index(index)
+    print(f"Обратный индекс:      {time.perf_counter() - start:8.3f} с")
+
+    rng = random.Random(3)
+    # Базовые пакеты (последние слои, большие номера) - самые тяжёлые запросы
+    names = [f"pkg{count - 1 - int(count * rng.random() ** 2)}" for _ in range(queries)]
+    timings = []
+    worst = (0, '')
+    for name in names:
+        start = time.perf_counter()
+        dependents = main.find_reverse_dependencies(index, name)
+        timings.append(time.perf_counter() - start)
+        worst = max(worst, (len(dependents), name))
+
+    timings.sort()
+    print(f"Медиана запроса:      {timings[len(timings) // 2] * 1000:8.3f} мс")
+    print(f"95-й перцентиль:      {timings[int(len(timings) * 0.95)] * 1000:8.3f} мс")
+    print(f"Худший запрос:        {timings[-1] * 1000:8.3f} мс")
+    print(f"{worst[1]} нужен {worst[0]} пакетам\n")
+
+
+def bench_ascii_tree(count=5000):
+    print(f"=== ASCII-дерево: {count} пакетов ===")
+    graph = make_synthetic_graph(count)
+    # Корень зависит от всех пакетов, от которых не зависит никто - достижим весь граф
+    used = {dep for deps in graph.values() for dep in deps}
+    root = 'world'
+    graph[root] = [name for name in graph if name not in used and name != root]
+    edges = sum(len(deps) for deps in graph.values())
+
+    start = time.perf_counter()
+    lines = size = 0
+    for line in main.render_ascii_tree(graph, root):
+        lines += 1
+        size += len(line) + 1
+    print(f"Отрисовка:            {time.perf_counter() - start:8.3f} с")
+    print(f"Строк: {lines} (рёбер в графе: {edges}), вывод: {size / 1024:.0f} КБ\n")
+
+
+def bench_mapped_index(count=100000):
+    print(f"=== Холодный старт: {count} пакетов, замыкание одного пакета ===")
+    index = main.parse_apkindex(make_apkindex_text(make_synthetic_graph(count)))
+    with tempfile.TemporaryDirectory() as root:
+        pickle_path = os.path.join(root, 'index.pickle')
+        mapped_path = os.path.join(root, 'index.kidx')
+        with open(pickle_path, 'wb') as f:
+            main.pickle.dump({'packages': index['packages'], 'provides': index['provides']}, f,
+                             protocol=main.pickle.HIGHEST_PROTOCOL)
+        main.write_mapped_index(index, mapped_path)
+        name = 'world'
+
+        start = time.perf_counter()
+        with open(pickle_path, 'rb') as f:
+            loaded = main.pickle.load(f)
+        get_package, resolve = main.make_package_lookups(loaded, name)
+        graph, _, _ = main.build_graph_bfs(name, get_package, resolve, quiet=True)
+        print(f"pickle + BFS:         {time.perf_counter() - start:8.3f} с "
+              f"({os.path.getsize(pickle_path) / 1024 / 1024:.1f} МБ, {len(graph) - 1} пакетов)")
+
+        start = time.perf_counter()
+        with main.MappedIndex(mapped_path) as mapped:
+            closure = mapped.closure(name)
+            print(f"mmap + замыкание:     {time.perf_counter() - start:8.3f} с "
+                  f"({os.path.getsize(mapped_path) / 1024 / 1024:.1f} МБ, {len(closure)} пакетов)\n")
+
+
+def bench_lazy_apkindex(count=100000):
+    print(f"=== Ленивый APKINDEX: {count} пакетов ===")
+    data = make_apkindex_text(make_synthetic_graph(count), full_records=True).encode()
+
+    # Нижняя граница для полного разбора: только записи, без индекса и графа
+    start = time.perf_counter()
+    records = list(main.iter_apkindex_records(data.decode()))
+    print(f"Разбор всех записей: {time.perf_counter() - start:6.3f} с ({len(records)} записей)")
+    del records
+
+    # Пакет из середины - небольшое замыкание; world - весь репозиторий
+    for name in (f"pkg{count // 2}", 'world'):
+        start = time.perf_counter()
+        index = main.parse_apkindex(data.decode())
+        graph, _, _ = main.build_graph_bfs(name, *main.make_package_lookups(index, name), quiet=True)
+        full_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = main.load_apkindex_lazy(data)
+        skim_time = time.perf_counter() - start
+        graph, _, _ = main.build_graph_bfs(name, *main.make_package_lookups(index, name), quiet=True)
+        lazy_time = time.perf_counter() - start
+
+        print(f"{name}: замыкание {len(graph) - 1} пакетов, полный разбор {full_time:6.3f} с, "
+              f"лениво {lazy_time:6.3f} с (из них первый проход {skim_time:.3f} с, "
+              f"разобрано записей: {len(index['packages'].records)})")
+    print()
+
+
+def bench_install_plan(count=100000, cycle_density=0.01):
+    print(f"=== Порядок установки: {count} пакетов, циклы {cycle_density} ===")
+    graph = make_synthetic_graph(count, fanout=4, depth=12, cycle_density=cycle_density)
+    edges = sum(len(deps) for deps in graph.values())
+
+    start = time.perf_counter()
+    plan = main.install_plan(graph)
+    print(f"install_plan:         {time.perf_counter() - start:8.3f} с ({edges} рёбер)")
+    print(f"Волн: {len(plan['waves'])}, циклов: {len(plan['cycles'])}, "
+          f"самая длинная цепочка: {len(main.critical_path(plan, 'world')) - 1}\n")
+
+
+def start_latency_server(graph, latency):
+    """Локальный HTTP-сервер: GET /<пакет> отдаёт его зависимости с задержкой latency"""
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            deps = graph.get(self.path.lstrip('/'))
+            if deps is None:
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            data = ' '.join(deps).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    class Server(http.server.ThreadingHTTPServer):
+        # По умолчанию очередь из 5 соединений - параллельные запросы бы ждали повтора SYN
+        request_queue_size = 128
+        daemon_threads = True
+
+    server = Server(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench_async_traversal(count=300, latency=0.02, fanouts=(1, 2, 4, 8), concurrency=32):
+    print(f"=== Обход с задержкой {latency * 1000:.0f} мс на пакет: {count} пакетов ===")
+    for fanout in fanouts:
+        graph = make_synthetic_graph(count, fanout, depth=6)
+        server = start_latency_server(graph, latency)
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+
+        # Обычная синхронная функция - async-обход сам запустит её в потоках
+        def get_package(name):
+            try:
+                with urllib.request.urlopen(f"{base}/{name}") as response:
+                    return main.PackageRecord(name, '1.0', response.read().decode())
+            except urllib.error.HTTPError:
+                return None
+
+        start = time.perf_counter()
+        graph_sync, _, _ = main.build_graph_bfs('world', get_package, quiet=True)
+        sync_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        graph_async, _, _ = main.build_graph_concurrent('world', get_package, quiet=True,
+                                                        max_concurrency=concurrency)
+        async_time = time.perf_counter() - start
+        server.shutdown()
+        server.server_close()
+
+        assert graph_sync == graph_async
+        print(f"fanout {fanout}: {len(graph_sync):4} пакетов, по очереди {sync_time:6.2f} с, "
+              f"параллельно {async_time:6.2f} с, ускорение x{sync_time / async_time:.1f}")
+    print()
+
+
+def make_file_tree(root, count, files_per_dir=100, apk_every=10):
+    """Дерево из count файлов: папки по files_per_dir файлов, каждый apk_every-й - .apk"""
+    for i in range(count):
+        directory = os.path.join(root, f"d{i // (files_per_dir * 10)}", f"s{i // files_per_dir}")
+        if i % files_per_dir == 0:
+            os.makedirs(directory, exist_ok=True)
+        name = f"f{i}.apk" if i % apk_every == 0 else f"f{i}.txt"
+        open(os.path.join(directory, name), 'w').close()
+    os.makedirs(os.path.join(root, '.git', 'objects'), exist_ok=True)
+    open(os.path.join(root, 'APKINDEX.tar.gz'), 'w').close()
+
+
+def bench_directory_scan(count=100000):
+    print(f"=== Поиск APKINDEX и .apk: дерево из {count} файлов ===")
+    with tempfile.TemporaryDirectory() as root:
+        make_file_tree(root, count)
+
+        # Как раньше: два полных os.walk - за APKINDEX и за .apk
+        start = time.perf_counter()
+        walked = {'apkindex': set(), 'apk': set()}
+        for kind, matches in (('apkindex', lambda name: name in ('APKINDEX', 'APKINDEX.tar.gz')),
+                              ('apk', lambda name: name.endswith('.apk'))):
+            for directory, subdirs, files in os.walk(root):
+                subdirs[:] = [name for name in subdirs if name not in main.SKIP_DIRECTORIES]
+                walked[kind].update(os.path.join(directory, name) for name in files if matches(name))
+        print(f"Два os.walk:          {time.perf_counter() - start:8.3f} с")
+
+        start = time.perf_counter()
+        result = main.scan_repository_tree(root)
+        print(f"scandir, первый раз:  {time.perf_counter() - start:8.3f} с")
+
+        start = time.perf_counter()
+        again = main.scan_repository_tree(root)
+        print(f"scandir, повторно:    {time.perf_counter() - start:8.3f} с")
+
+        for kind in ('apkindex', 'apk'):
+            assert set(result[kind]) == set(again[kind]) == walked[kind], f"{kind}: обходы нашли разное"
+        print(f"Найдено .apk: {len(result['apk'])}, APKINDEX: {len(result['apkindex'])} "
+              f"(совпадает с os.walk)\n")
+
+
+# НАБОР ПО СТАДИЯМ
+
+SUITE_STAGES = ('load', 'parse', 'index', 'traverse', 'render')
+
+
+def suite_stages(repo_format, path):
+    """Стадии обработки репозитория - функции, каждая получает результат предыдущей"""
+    def load(_):
+        if repo_format == 'test':
+            with open(path, 'rb') as f:
+                return f.read()
+        # Распаковка: gzip + tar, строки APKINDEX
+        with open(path, 'rb') as f:
+            return list(main.open_apkindex_stream(f, path))
+
+    def parse(data):
+        if repo_format == 'test':
+            # read_test_repo читает файл сам (после load он уже в кэше ОС)
+            return list(main.read_test_repo(path).values())
+        return list(main.iter_apkindex_records(data))
+
+    def index(records):
+        return main.build_package_index(records)
+
+    def traverse(index):
+        get_package = lambda name: main.find_package_in_index(index, name, '')
+        graph, _, cycles = main.build_graph_bfs('world', get_package, quiet=True)
+        return graph
+
+    def render(graph):
+        out = io.StringIO()
+        writer = main.TreeWriter(out)
+        writer.start('world')
+        writer.finish(graph, [])
+        return out.tell()
+
+    return [load, parse, index, traverse, render]
+
+
+def run_stages(stages, memory=False):
+    """Время (или пик памяти по tracemalloc) каждой стадии"""
+    result = {}
+    value = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        for stage in stages:
+            if memory:
+                tracemalloc.start()
+                value = stage(value)
+                result[stage.__name__] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            else:
+                start = time.perf_counter()
+                value = stage(value)
+                result[stage.__name__] = time.perf_counter() - start
+    return result
+
+
+def run_suite(sizes, fanout=4, depth=8, cycle_density=0.01, repeat=3):
+    print(f"=== Стадии: fanout={fanout}, depth={depth}, циклы={cycle_density} ===")
+    print(f"{'формат':8} {'пакетов':>8} " + ' '.join(f"{stage:>10}" for stage in SUITE_STAGES) + f" {'пик, МБ':>9}")
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        for count in sizes:
+            graph = make_synthetic_graph(count, fanout, depth, cycle_density)
+            edges = sum(len(deps) for deps in graph.values())
+            paths = {
+                'test': os.path.join(root, f"test-{count}.txt"),
+                'apkindex': os.path.join(root, f"APKINDEX-{count}.tar.gz"),
+            }
+            write_test_repo(graph, paths['test'])
+            write_apkindex_archive(graph, paths['apkindex'])
+
+            for repo_format, path in paths.items():
+                stages = suite_stages(repo_format, path)
+                # Лучшее из repeat запусков; память - отдельным запуском, tracemalloc сильно замедляет
+                timings = [run_stages(stages) for _ in range(repeat)]
+                times = {stage: min(t[stage] for t in timings) for stage in SUITE_STAGES}
+                memory = run_stages(stages, memory=True)
+                results.append({
+                    'format': repo_format,
+                    'packages': len(graph),
+                    'edges': edges,
+                    'time': times,
+                    'peak_memory': memory,
+                })
+                print(f"{repo_format:8} {len(graph):>8} "
+                      + ' '.join(f"{times[stage]:10.4f}" for stage in SUITE_STAGES)
+                      + f" {max(memory.values()) / 1024 / 1024:9.2f}")
+    print()
+    return results
+
+
+def compare_results(old, new):
+    """Во сколько раз изменилось время стадий относительно старого прогона"""
+    print("=== Сравнение с предыдущим прогоном (новое / старое время) ===")
+    previous = {(r['format'], r['packages']): r for r in old['results']}
+    for result in new['results']:
+        before = previous.get((result['format'], result['packages']))
+        if before is None:
+            continue
+        ratios = []
+        for stage in SUITE_STAGES:
+            if before['time'].get(stage):
+                ratios.append(f"{stage} x{result['time'][stage] / before['time'][stage]:.2f}")
+        print(f"{result['format']:8} {result['packages']:>8}  " + '  '.join(ratios))
+    print()
+
+
+def suite_main(argv):
+    parser = argparse.ArgumentParser(prog='benchmark.py suite',
+                                     description="Замеры стадий на синтетических репозиториях")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+    parser.add_argument('--fanout', type=int, default=4, help="максимум зависимостей у пакета")
+    parser.add_argument('--depth', type=int, default=8, help="число слоёв графа")
+    parser.add_argument('--cycles', type=float, default=0.01, help="доля пакетов с обратным ребром")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', metavar='FILE', help="сохранить результаты в JSON")
+    parser.add_argument('--compare', metavar='FILE', help="сравнить с сохранённым JSON")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.sizes, args.fanout, args.depth, args.cycles, args.repeat)
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'params': {'fanout': args.fanout, 'depth': args.depth,
+                   'cycles': args.cycles, 'repeat': args.repeat},
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Результаты записаны в {args.json}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare_results(json.load(f), report)
+
+
+def bench_main(argv):
+    if argv[:1] == ['suite']:
+        suite_main(argv[1:])
+        return
+    count = int(argv[0]) if argv else 50000
+    bench_graph_memory(count)
+    bench_whole_repository()
+    bench_reverse_queries()
+    bench_ascii_tree()
+    bench_mapped_index()
+    bench_install_plan()
+    bench_lazy_apkindex()
+    bench_async_traversal()
+    bench_directory_scan()
+
+
+if __name__ == '__main__':
+    # Кэш замеров не должен смешиваться с настоящим и переживать запуск
+    with tempfile.TemporaryDirectory(prefix='konfig2-bench-') as cache_dir:
+        main.CACHE_DIR = cache_dir
+        bench_main(sys.argv[1:])
@@ -1,20 +1,49 @@
 import csv
 import sys
-import urllib.request
+import argparse
+import contextlib
+import urllib.error
+import urllib.parse
+import http.client
+import http.server
 import tarfile
 import gzip
 import ssl
 import os
 import subprocess
-import tempfile
 import shutil
-from io import BytesIO
-from collections import deque
+import hashlib
+import json
+import pickle
+import re
+import bisect
+import functools
+import io
+import threading
+import asyncio
+import inspect
+import time
+import mmap
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import deque, OrderedDict
+from collections.abc import Mapping
+from array import array
 """ `csv` — чтение и парсинг конфигурации;
     `sys` — завершение программы при ошибках;
-    `urllib.request` — загрузка данных по HTTP;
-    `tarfile`, gzip, BytesIO — распаковка архивов;
-    `os`, `subprocess`, `tempfile`, `shutil` — работа с файловой системой и git;
+    `argparse`, `contextlib` — пакетный запуск из командной строки;
+    `urllib`, `http.client` — загрузка данных по HTTP (keep-alive соединения);
+    `http.server` — режим сервера (--serve) с запросами по HTTP на localhost;
+    `threading`, `concurrent.futures` — параллельная загрузка индексов и чтение .apk;
+    `asyncio`, `inspect` — обход графа с параллельными запросами к медленным источникам;
+    `time` — замеры времени стадий (--stats);
+    `tarfile`, `gzip`, `io` — потоковая распаковка архивов;
+    `os`, `subprocess`, `shutil` — работа с файловой системой и git;
+    `hashlib`, `json`, `pickle` — кэш скачанных индексов на диске;
+    `array` — компактное хранение графа (CSR);
+    `mmap`, `struct`, `zlib` — бинарный индекс, который читается без разбора (--index);
+    `re`, `bisect`, `functools` — сравнение версий и ограничения зависимостей;
     `ssl` — корректная работа HTTPS на macOS.
 """
 
@@ -23,7 +52,31 @@ ssl_context = ssl.create_default_context()
 ssl_context.check_hostname = False
 ssl_context.verify_mode = ssl.CERT_NONE
 
-def main():
+def main(argv=None):
+    """Без аргументов - интерактивный выбор конфига, иначе пакетный режим"""
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv:
+        run_interactive()
+        return
+    
+    args = parse_args(argv)
+    stats = enable_stats() if args.stats or args.stats_json else None
+    if args.serve:
+        run_server(read_configs(args), args.port, args.refresh, args.cache_size)
+    elif args.index:
+        run_mapped_index(args)
+    else:
+        run_batch(args)
+    
+    if args.stats:
+        print_stats(stats)
+    if args.stats_json:
+        with open(args.stats_json, 'w', encoding='utf-8') as f:
+            json.dump(stats.to_dict(), f, ensure_ascii=False, indent=2)
+
+
+def run_interactive():
     dep_choice_made = ""
     choice = int(input("""Введите номер файла:
                 1. config_1
@@ -51,7 +104,7 @@ def main():
                 case 2:
                     dep_choice_made = "test_dep_cycle.txt"
                 case 3:
-                    dep_choice_made = "test_dep_cycle.txt"
+                    dep_choice_made = "test_dep_complex.txt"
         
 
 
@@ -68,6 +121,218 @@ def main():
     build_dependency_graph(config)
 
 
+# ПАКЕТНЫЙ РЕЖИМ
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Граф зависимостей пакетов Alpine Linux",
+        epilog="Без аргументов программа спрашивает номер конфига интерактивно.")
+    parser.add_argument('configs', nargs='*', metavar='CONFIG',
+                        help="CSV-файлы конфигурации (param,value)")
+    parser.add_argument('-p', '--package', action='append', default=[], dest='packages', metavar='PACKAGE',
+                        help="пакет для анализа, можно с ограничением: 'curl>=8.0'. "
+                             "Повторяется; заменяет package_name из конфигов")
+    parser.add_argument('--packages-file', metavar='FILE',
+                        help="файл со списком пакетов (по одному в строке), '-' - stdin")
+    parser.add_argument('--dep-file', default='', metavar='FILE',
+                        help="файл тестового репозитория вместо repository_url (для repo_mode=test)")
+    parser.add_argument('--query', choices=['deps', 'rdeps', 'diff'],
+                        help="тип запроса вместо query из конфигов")
+    parser.add_argument('--output-dir', metavar='DIR',
+                        help="записать результат каждого пакета в DIR/<пакет>.<формат>")
+    parser.add_argument('-f', '--format', choices=list(GRAPH_WRITERS),
+                        help="формат вывода графа вместо output_format/ascii_output из конфигов")
+    parser.add_argument('--max-depth', type=int, metavar='N',
+                        help="глубина ASCII-дерева (формат tree)")
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help="не печатать каждый узел во время обхода")
+    parser.add_argument('--lazy', action='store_true',
+                        help="разбирать только те записи APKINDEX, до которых дошёл обход")
+    parser.add_argument('--write-index', metavar='FILE',
+                        help="сохранить загруженный репозиторий в бинарный индекс")
+    parser.add_argument('--index', metavar='FILE',
+                        help="искать зависимости в бинарном индексе (mmap) вместо загрузки "
+                             "репозитория; нужен хотя бы один -p")
+    parser.add_argument('--serve', action='store_true',
+                        help="режим сервера: держать индексы в памяти и отвечать на HTTP-запросы")
+    parser.add_argument('--port', type=int, default=8377, help="порт сервера на 127.0.0.1")
+    parser.add_argument('--refresh', type=int, default=300, metavar='SECONDS',
+                        help="как часто сервер перечитывает репозитории (0 - никогда)")
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help="сколько ответов сервер держит в LRU-кэше")
+    parser.add_argument('--stats', action='store_true',
+                        help="в конце напечатать время стадий и счётчики (в stderr)")
+    parser.add_argument('--stats-json', metavar='FILE',
+                        help="сохранить время стадий и счётчики в JSON")
+    args = parser.parse_args(argv)
+    if not args.configs and not args.index:
+        parser.error("нужен хотя бы один CONFIG или --index")
+    return args
+
+
+def read_package_list(path):
+    """Список пакетов: по одному в строке, пустые строки и # комментарии пропускаются"""
+    try:
+        if path == '-':
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+    except OSError as e:
+        print(f"ОШИБКА: Не удалось прочитать список пакетов '{path}': {e}")
+        sys.exit(1)
+
+    packages = []
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if line:
+            # "curl 8.5.0" - то же самое, что "curl=8.5.0"
+            name, _, version = line.partition(' ')
+            version = version.strip()
+            if version and version[0] not in '<>=~':
+                version = '=' + version
+            packages.append(name + version)
+    return packages
+
+
+def parse_package_spec(package):
+    """'curl>=8.0' -> ('curl', '>=8.0'); конфликт '!foo' пакетом для анализа быть не может"""
+    name, op, version, conflict = parse_dependency(package)
+    if conflict:
+        print(f"ОШИБКА: '{package}' - конфликт, а не пакет; уберите '!'", file=sys.stderr)
+        sys.exit(1)
+    # Оператор сохраняем: голая версия в package_version означает нечёткое ~
+    return name, f"{op}{version}"
+
+
+def package_config(config, package):
+    """Копия конфига для другого стартового пакета ('curl>=8.0' -> имя и версия)"""
+    if package == '*':
+        return dict(config, package_name='*', package_version='')
+    name, version = parse_package_spec(package)
+    return dict(config, package_name=name, package_version=version)
+
+
+def repository_key(config):
+    """Конфиги с одинаковым ключом работают с одним и тем же индексом"""
+    return (config['repo_mode'], config['repository_url'], config.get('arch', ''))
+
+
+def result_path(output_dir, package_name, extension='.txt'):
+    safe_name = re.sub(r'[^\w.+-]', '_', package_name) if package_name != '*' else 'all'
+    return os.path.join(output_dir, safe_name + extension)
+
+
+def run_mapped_index(args):
+    """Пакеты из -p/--packages-file по бинарному индексу, без загрузки репозитория
+    
+    Зависимости в индексе уже разрешены (provides, версии - самые новые),
+    поэтому ограничения версий из -p здесь не учитываются.
+    """
+    packages = list(args.packages)
+    if args.packages_file:
+        packages += read_package_list(args.packages_file)
+    if not packages:
+        print("ОШИБКА: Для --index нужен хотя бы один пакет (-p или --packages-file)")
+        sys.exit(1)
+    names = [parse_package_spec(package)[0] for package in packages]
+    
+    config = {'output_format': args.format or 'text', 'quiet': 'true' if args.quiet else 'false'}
+    if args.max_depth is not None:
+        config['max_depth'] = str(args.max_depth)
+    
+    try:
+        mapped = MappedIndex(args.index)
+    except (OSError, ValueError) as e:
+        print(f"ОШИБКА: {e}")
+        sys.exit(1)
+    with mapped:
+        for name in names:
+            writer = make_graph_writer(config, sys.stdout)
+            with log_to_stderr(config):
+                writer.start(name)
+                graph, visited, cycles = build_graph_bfs(name, mapped.get, on_node=writer.node,
+                                                         quiet=config['quiet'] == 'true')
+                writer.finish(graph, cycles)
+
+
+def read_configs(args):
+    """Конфиги из командной строки с учётом флагов, которые их переопределяют"""
+    configs = []
+    for config_file in args.configs:
+        config = read_config(config_file, "")
+        # Файл тестового репозитория подменяет только тестовые конфиги
+        if args.dep_file and config.get('repo_mode') == 'test':
+            config['repository_url'] = args.dep_file
+        if args.query:
+            config['query'] = args.query
+        if args.format:
+            config['output_format'] = args.format
+        if args.quiet:
+            config['quiet'] = 'true'
+        if args.max_depth is not None:
+            config['max_depth'] = str(args.max_depth)
+        if args.lazy:
+            config['lazy_index'] = 'true'
+        validate_config(config)
+        configs.append(config)
+    return configs
+
+
+def run_batch(args):
+    """Все пакеты из всех конфигов; каждый репозиторий загружается один раз"""
+    packages = list(args.packages)
+    if args.packages_file:
+        packages += read_package_list(args.packages_file)
+    # Ошибки в списке пакетов - до загрузки репозиториев
+    jobs = [package_config({}, package) for package in packages]
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    indexes = {}
+    done = set()
+    written = set()
+    for config_file, config in zip(args.configs, read_configs(args)):
+        key = repository_key(config)
+        if key not in indexes:
+            with log_to_stderr(config):
+                print_config(config)
+                indexes[key] = load_repository_index(config)
+        index = indexes[key]
+        if not index:
+            print(f"ОШИБКА: Репозиторий из '{config_file}' не загружен, пропускаем\n", file=sys.stderr)
+            continue
+
+        for job in [dict(config, **job) for job in jobs] or [config]:
+            job_key = (key, job['package_name'], job['package_version'], job.get('query', 'deps'))
+            if job_key in done:
+                continue
+            done.add(job_key)
+
+            if not args.output_dir:
+                build_dependency_graph(job, index)
+                if output_format(job) == 'text':
+                    print()
+                continue
+
+            # Один файл на пакет: результаты из разных репозиториев дописываются в него же
+            path = result_path(args.output_dir, job['package_name'],
+                               GRAPH_WRITERS[output_format(job)].extension)
+            with open(path, 'a' if path in written else 'w', encoding='utf-8') as f:
+                with contextlib.redirect_stdout(f):
+                    build_dependency_graph(job, index)
+            written.add(path)
+            print(f"{job['package_name']}: {path}", file=sys.stderr)
+
+    print(f"Репозиториев загружено: {len(indexes)}, пакетов обработано: {len(done)}", file=sys.stderr)
+    
+    # Один файл на все репозитории: порядок слияния - порядок конфигов
+    loaded = [index for index in indexes.values() if index]
+    if args.write_index and loaded:
+        write_mapped_index(loaded[0] if len(loaded) == 1 else merge_indexes(loaded), args.write_index)
+        print(f"Бинарный индекс записан: {args.write_index}", file=sys.stderr)
+
+
 def read_config(filename, dep_choice_made):
     config = {}
     
@@ -105,10 +370,22 @@ def validate_config(config):
         print(f"ОШИБКА: repo_mode должен быть 'test' или 'prod'")
         sys.exit(1)
     
-    if 'ascii_output' in config:
-        if config['ascii_output'].lower() not in ['true', 'false']:
-            print(f"ОШИБКА: ascii_output должен быть 'true' или 'false'")
+    if config.get('query', 'deps') not in ['deps', 'rdeps', 'diff']:
+        print(f"ОШИБКА: query должен быть 'deps', 'rdeps' или 'diff'")
+        sys.exit(1)
+    
+    for param in ['ascii_output', 'quiet', 'lazy_index']:
+        if param in config and config[param].lower() not in ['true', 'false']:
+            print(f"ОШИБКА: {param} должен быть 'true' или 'false'")
             sys.exit(1)
+    
+    if config.get('max_depth') and not config['max_depth'].isdigit():
+        print(f"ОШИБКА: max_depth должен быть неотрицательным целым числом")
+        sys.exit(1)
+    
+    if config.get('output_format', 'text') not in GRAPH_WRITERS:
+        print(f"ОШИБКА: output_format должен быть одним из: {', '.join(GRAPH_WRITERS)}")
+        sys.exit(1)
 
 
 def print_config(config):
@@ -133,43 +410,563 @@ def check_repo_type(url, repo_mode):
     else: return 'unknown'
 
 
+# ЗАМЕРЫ
+
+# Включается enable_stats(); пока None - замеров нет совсем
+STATS = None
+
+# Функции, время которых меряем. Обёртки ставятся только при включённых
+# замерах, поэтому без --stats код работает ровно как без них
+INSTRUMENTED = (
+    'http_get',
+    'download_apkindex_http',
+    'clone_git_repo',
+    'scan_repository_tree',
+    'read_apkindex_from_file',
+    'read_apk_files',
+    'read_apk_file',
+    'build_package_index',
+    'find_package_in_apkindex',
+    'find_package_in_index',
+    'resolve_dependency',
+    'build_graph_bfs',
+    'compute_all_closures',
+)
+
+
+class Stats:
+    """Таймеры (вызовы, суммарное и худшее время) и счётчики"""
+    
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+    
+    def add_time(self, name, elapsed):
+        with self.lock:
+            timer = self.timers.setdefault(name, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += elapsed
+            timer[2] = max(timer[2], elapsed)
+    
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+    
+    def to_dict(self):
+        return {
+            'timers': {name: {'calls': calls, 'total': total, 'max': worst}
+                       for name, (calls, total, worst) in self.timers.items()},
+            'counters': dict(self.counters),
+        }
+
+
+def timed(name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            STATS.add_time(name, time.perf_counter() - start)
+    return wrapper
+
+
+def enable_stats():
+    """Включает замеры: подменяет функции из INSTRUMENTED на обёртки с таймером
+    
+    Функции вызывают друг друга через глобальные имена модуля, поэтому
+    подмены достаточно. read_apk_file в отдельных процессах (пул в
+    read_apk_files) меряется только целиком, через read_apk_files.
+    """
+    global STATS
+    if STATS is None:
+        STATS = Stats()
+        for name in INSTRUMENTED:
+            globals()[name] = timed(name, globals()[name])
+    return STATS
+
+
+def count_stat(name, n=1):
+    if STATS is not None:
+        STATS.count(name, n)
+
+
+def print_stats(stats, file=None):
+    """Таблица замеров; по умолчанию в stderr, чтобы не смешивать с выводом графа"""
+    file = file or sys.stderr
+    print("\n" + "="*72, file=file)
+    print(f"{'функция':28} {'вызовов':>9} {'всего, с':>10} {'среднее, мс':>12} {'худшее, мс':>10}", file=file)
+    print("="*72, file=file)
+    for name, (calls, total, worst) in sorted(stats.timers.items(), key=lambda item: -item[1][1]):
+        print(f"{name:28} {calls:9} {total:10.3f} {total / calls * 1000:12.3f} {worst * 1000:10.3f}", file=file)
+    if stats.counters:
+        print("-"*72, file=file)
+        for name, value in stats.counters.items():
+            print(f"{name:28} {value:9}", file=file)
+    print("="*72, file=file)
+
+
+# ЗАПИСИ О ПАКЕТАХ
+
+class PackageRecord:
+    """Информация о пакете: имя, версия, зависимости и provides (строками как в APKINDEX)
+    
+    __slots__ вместо словаря: на целом репозитории (десятки тысяч пакетов) это
+    в разы меньше памяти. Доступ как к словарю (record['name'], record.get('depends'))
+    оставлен, чтобы старый код работал без изменений.
+    """
+    __slots__ = ('name', 'version', 'depends', 'provides')
+    
+    def __init__(self, name=None, version=None, depends='', provides=''):
+        self.name = name
+        self.version = version
+        self.depends = depends
+        self.provides = provides
+    
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+    
+    def get(self, key, default=None):
+        if key not in self.__slots__:
+            return default
+        return getattr(self, key)
+    
+    def __repr__(self):
+        return f"PackageRecord({self.name!r}, {self.version!r}, {self.depends!r}, {self.provides!r})"
+
+
+# КЭШ
+
+# Папка кэша: можно переопределить переменной окружения KONFIG_CACHE_DIR
+CACHE_DIR = os.environ.get(
+    'KONFIG_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'konfig2')
+)
+
+# Меняется при изменении формата разобранного индекса - старый кэш игнорируется
+INDEX_CACHE_VERSION = 6
+
+
+def get_cache_dir(*parts):
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def cache_key(*parts):
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+def write_file_atomic(path, data):
+    """Пишет файл через временный, чтобы параллельный запуск не увидел половину"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def read_cache_meta(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    
+    if meta.get('version') != INDEX_CACHE_VERSION:
+        return {}
+    return meta
+
+
+def load_cached_index(cache_dir, filename='index.pickle'):
+    try:
+        with open(os.path.join(cache_dir, filename), 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        return None
+
+
+def rotate_snapshot(cache_dir):
+    """Текущий снимок индекса (и его замыкания) становится предыдущим - для сравнения"""
+    for name in ('index', 'closures'):
+        current = os.path.join(cache_dir, f'{name}.pickle')
+        previous = os.path.join(cache_dir, f'{name}.prev.pickle')
+        if os.path.exists(current):
+            os.replace(current, previous)
+        elif os.path.exists(previous):
+            os.remove(previous)
+
+
+def save_cached_index(cache_dir, url, index, response_headers):
+    """Разобранный индекс и заголовки для условного запроса
+    
+    Ленивый индекс (--lazy) не сохраняется: он живёт поверх скачанного архива,
+    и следующий ленивый запуск снова прочитает архив. Без index.pickle обычный
+    запуск на 304 просто скачает индекс заново.
+    """
+    try:
+        if not isinstance(index['packages'], LazyRecords):
+            write_file_atomic(
+                os.path.join(cache_dir, 'index.pickle'),
+                pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL)
+            )
+        meta = {
+            'version': INDEX_CACHE_VERSION,
+            'url': url,
+            'etag': response_headers.get('ETag'),
+            'last_modified': response_headers.get('Last-Modified'),
+        }
+        write_file_atomic(
+            os.path.join(cache_dir, 'meta.json'),
+            json.dumps(meta, ensure_ascii=False).encode('utf-8')
+        )
+    except OSError as e:
+        print(f"Не удалось сохранить кэш: {e}")
+
+
 # HTTP
 
-def download_apkindex_http(repository_url):
+class TeeReader(io.RawIOBase):
+    """Поток, который при чтении параллельно пишет прочитанное в файл (для кэша)"""
+    
+    def __init__(self, stream, sink=None):
+        self.stream = stream
+        self.sink = sink
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        data = self.stream.read(len(buffer))
+        if self.sink and data:
+            self.sink.write(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def open_apkindex_stream(stream, name):
+    """Текстовый поток APKINDEX поверх бинарного потока - архив не читается в память целиком
+    
+    APKINDEX.tar.gz в Alpine - это несколько gzip-потоков подряд (подпись + индекс),
+    поэтому gzip разбираем через GzipFile, а tar - в потоковом режиме 'r|'.
+    """
+    if not name.endswith('.tar.gz'):
+        return decode_lines(stream)
+    
+    tar = tarfile.open(fileobj=gzip.GzipFile(fileobj=stream), mode='r|')
+    for member in tar:
+        if member.name == 'APKINDEX':
+            return decode_lines(tar.extractfile(member))
+    
+    return None
+
+
+def decode_lines(binary_stream):
+    for raw_line in binary_stream:
+        yield raw_line.decode('utf-8', errors='ignore')
+
+
+# Простаивающие keep-alive соединения, общие для всех потоков: (схема, хост) ->
+# [соединения]. Запрос берёт соединение из пула, release_http_connection
+# возвращает его обратно, так что повторные запросы к зеркалу (другие arch,
+# следующее обновление сервера) идут по уже открытому соединению
+_http_pool = {}
+_http_pool_lock = threading.Lock()
+HTTP_POOL_SIZE = 8
+
+
+def _acquire_http_connection(parts):
+    key = (parts.scheme, parts.netloc)
+    with _http_pool_lock:
+        idle = _http_pool.get(key)
+        if idle:
+            count_stat('http: соединение из пула')
+            return key, idle.pop()
+    
+    if parts.scheme == 'https':
+        conn = http.client.HTTPSConnection(parts.netloc, timeout=60, context=ssl_context)
+    else:
+        conn = http.client.HTTPConnection(parts.netloc, timeout=60)
+    return key, conn
+
+
+def release_http_connection(response):
+    """Возвращает соединение ответа в пул
+    
+    Если тело не дочитано, соединение закрывается - иначе следующий запрос
+    получит мусор (закрытое соединение при следующем запросе откроется заново).
+    """
+    key, conn = getattr(response, 'pool_entry', (None, None))
+    if conn is None:
+        return
+    response.pool_entry = None
+    if not response.isclosed():
+        conn.close()
+    with _http_pool_lock:
+        idle = _http_pool.setdefault(key, [])
+        if len(idle) < HTTP_POOL_SIZE:
+            idle.append(conn)
+            return
+    conn.close()
+
+
+def http_get(url, headers=None, max_redirects=5):
+    """GET через соединение из общего пула (keep-alive к тому же хосту)
+    
+    Возвращает http.client.HTTPResponse; после чтения тела (или отказа от него)
+    нужно вызвать release_http_connection.
+    """
+    for _ in range(max_redirects + 1):
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        
+        key, conn = _acquire_http_connection(parts)
+        try:
+            conn.request('GET', path, headers=headers or {})
+            response = conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            # Сервер мог закрыть простаивающее соединение - переподключаемся один раз
+            conn.close()
+            try:
+                conn.request('GET', path, headers=headers or {})
+                response = conn.getresponse()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                raise
+        response.pool_entry = (key, conn)
+        
+        if response.status in (301, 302, 303, 307, 308):
+            location = response.getheader('Location')
+            response.read()
+            release_http_connection(response)
+            url = urllib.parse.urljoin(url, location)
+            continue
+        
+        return response
+    
+    raise urllib.error.URLError(f"слишком много перенаправлений: {url}")
+
+
+# Индексы, уже загруженные этим процессом: на 304 отдаётся тот же объект,
+# и сервер по `is` видит, что репозиторий не изменился
+_loaded_indexes = {}
+
+
+def download_apkindex_http(repository_url, arch='x86_64', use_cache=True, lazy=False):
+    """Скачивает APKINDEX и возвращает разобранный индекс пакетов
+    
+    Ответ сервера разбирается потоком: gzip -> tar -> строки -> пакеты,
+    поэтому в памяти нет ни архива, ни текста индекса целиком.
+    
+    Скачанный архив и разобранный индекс хранятся в кэше (ключ - URL и arch).
+    Повторный запуск отправляет условный запрос (If-None-Match / If-Modified-Since):
+    если индекс не изменился, сервер отвечает 304 и мы ничего не парсим.
+    
+    lazy - не разбирать записи (load_apkindex_lazy): при ответе 200 индекс
+    строится по тексту из ответа, при 304 - по скачанному ранее архиву.
+    """
     
     if repository_url.endswith('/'):
         repository_url = repository_url[:-1]
     
+    cache_dir = index_cache_dir(repository_url, arch) if use_cache else None
+    meta = read_cache_meta(cache_dir) if cache_dir else {}
+    
     # Разные пути туда сюда
     urls_to_try = [
-        f"{repository_url}/x86_64/APKINDEX.tar.gz",
+        f"{repository_url}/{arch}/APKINDEX.tar.gz",
         f"{repository_url}/APKINDEX.tar.gz",
         f"{repository_url}/APKINDEX",
     ]
     
+    # Сначала пробуем тот адрес, который сработал в прошлый раз
+    if meta.get('url') in urls_to_try:
+        urls_to_try.remove(meta['url'])
+        urls_to_try.insert(0, meta['url'])
+    
     for url in urls_to_try:
         print(f"Пытаемся скачать APKINDEX: {url}")
         
+        headers = {}
+        if meta.get('url') == url:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        
+        raw_path = os.path.join(cache_dir, os.path.basename(url)) if cache_dir else None
+        tmp_path = f"{raw_path}.{os.getpid()}.{threading.get_ident()}.tmp" if raw_path else None
+        
         try:
-            response = urllib.request.urlopen(url, context=ssl_context)
-            data = response.read()
+            response = http_get(url, headers)
             
-            # Если это .tar.gz - распаковываем
-            if url.endswith('.tar.gz'):
-                with gzip.GzipFile(fileobj=BytesIO(data)) as gz:
-                    text = gz.read().decode('utf-8', errors='ignore')
-            else:
-                text = data.decode('utf-8', errors='ignore')
+            if response.status == 304:
+                response.read()
+                release_http_connection(response)
+                index = _loaded_indexes.get((cache_dir, lazy))
+                if index is not None:
+                    count_stat('http: 304 из памяти')
+                    print("Не изменился - индекс уже загружен\n")
+                    return index
+                if lazy and os.path.exists(raw_path):
+                    count_stat('http: 304 из кэша')
+                    print("Не изменился - читаем скачанный архив лениво\n")
+                    index = _loaded_indexes[(cache_dir, lazy)] = read_apkindex_from_file(raw_path, lazy=True)
+                    return index
+                index = load_cached_index(cache_dir)
+                if index is not None:
+                    count_stat('http: 304 из кэша')
+                    print("Не изменился - берём из кэша\n")
+                    _loaded_indexes[(cache_dir, lazy)] = index
+                    return index
+                # Кэш пропал - просим полный ответ
+                response = http_get(url)
             
-            print("Успешно\n")
-            return text
+            if response.status != 200:
+                response.read()
+                release_http_connection(response)
+                raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+            
+            sink = open(tmp_path, 'wb') if tmp_path else None
+            try:
+                stream = io.BufferedReader(TeeReader(response, sink))
+                if lazy:
+                    # Только текст индекса - записи разберутся по мере обхода графа
+                    data = read_apkindex_bytes(stream, url)
+                    if data is None:
+                        raise ValueError("в архиве нет файла APKINDEX")
+                    index = load_apkindex_lazy(data)
+                else:
+                    lines = open_apkindex_stream(stream, url)
+                    if lines is None:
+                        raise ValueError("в архиве нет файла APKINDEX")
+                    index = build_package_index(iter_apkindex_records(lines))
+                
+                # Дочитываем хвост: для полной копии в кэше и чтобы соединение можно было переиспользовать
+                while stream.read(1 << 16):
+                    pass
+            finally:
+                if sink:
+                    sink.close()
+                release_http_connection(response)
             
+            if cache_dir:
+                os.replace(tmp_path, raw_path)
+                rotate_snapshot(cache_dir)
+                save_cached_index(cache_dir, url, index, response.headers)
+                _loaded_indexes[(cache_dir, lazy)] = index
+            
+            print("Успешно\n")
+            return index
+        
         except Exception as e:
             print(f"Не успешно: {e}")
+        
+        finally:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    
+    # Сети нет - лучше старый индекс, чем никакого
+    if meta:
+        raw_path = os.path.join(cache_dir, os.path.basename(meta.get('url', '')))
+        if lazy and os.path.isfile(raw_path):
+            index = read_apkindex_from_file(raw_path, lazy=True)
+        else:
+            index = load_cached_index(cache_dir)
+        if index is not None:
+            print("ВНИМАНИЕ: Используем устаревший индекс из кэша\n")
+            return index
     
     print("ОШИБКА: Не смогли скачать APKINDEX")
     return None
 
+def merge_indexes(indexes):
+    """Объединяет несколько индексов в один
+    
+    Порядок важен: при одинаковых версиях выигрывает индекс, идущий раньше
+    (как порядок репозиториев в /etc/apk/repositories).
+    """
+    # Ленивые индексы (--lazy) сливаются тоже лениво, иначе пришлось бы
+    # разобрать все их записи
+    if any(isinstance(index['packages'], LazyRecords) for index in indexes):
+        return {
+            'packages': MergedRecords([index['packages'] for index in reversed(indexes)], sort=True),
+            'provides': MergedRecords([index['provides'] for index in indexes]),
+        }
+    
+    merged = {
+        'packages': {},
+        'provides': {}
+    }
+    
+    for field, ordered in (('packages', reversed(indexes)), ('provides', indexes)):
+        target = merged[field]
+        for index in ordered:
+            for name, pkgs in index[field].items():
+                if name in target:
+                    target[name] = target[name] + pkgs
+                else:
+                    target[name] = list(pkgs)
+    
+    # Берётся самая новая версия (последняя), а при равных версиях - из более
+    # приоритетного репозитория: поэтому пакеты сливались в обратном порядке
+    for versions in merged['packages'].values():
+        versions.sort(key=record_version_key)
+    
+    return merged
+
+
+# (задания, lazy) -> (индексы, их объединение) последнего вызова fetch_indexes
+_merged_indexes = {}
+
+
+def fetch_indexes(repository_urls, arches=('x86_64',), max_workers=8, use_cache=True, lazy=False):
+    """Параллельно скачивает и разбирает индексы для всех пар (репозиторий, arch)
+    
+    Время примерно равно времени самого медленного индекса, а не сумме.
+    Приоритет при слиянии - порядок repository_urls, затем порядок arches.
+    """
+    jobs = [(url, arch) for url in repository_urls for arch in arches]
+    
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(jobs))) as executor:
+        futures = [
+            executor.submit(download_apkindex_http, url, arch, use_cache, lazy=lazy)
+            for url, arch in jobs
+        ]
+        results = [future.result() for future in futures]
+    
+    indexes = []
+    for (url, arch), index in zip(jobs, results):
+        if index is None:
+            print(f"ВНИМАНИЕ: Индекс {url} ({arch}) не загружен")
+        else:
+            indexes.append(index)
+    
+    if not indexes:
+        return None
+    
+    if len(indexes) == 1:
+        return indexes[0]
+    
+    # Ни один индекс не изменился - тот же объединённый индекс, что и в прошлый раз
+    previous = _merged_indexes.get((tuple(jobs), lazy))
+    if previous and len(previous[0]) == len(indexes) and all(
+            old is new for old, new in zip(previous[0], indexes)):
+        return previous[1]
+    
+    merged = merge_indexes(indexes)
+    _merged_indexes[(tuple(jobs), lazy)] = (indexes, merged)
+    return merged
+
 #TEST
 
 def read_test_repo(filepath):
@@ -207,11 +1004,7 @@ def read_test_repo(filepath):
                 else:
                     depends = ''
                 
-                test_packages[package_name] = {
-                    'name': package_name,
-                    'version': '1.0',
-                    'depends': depends
-                }
+                test_packages[package_name] = PackageRecord(package_name, '1.0', depends)
         
         print(f"Загружено {len(test_packages)} тестовых пакетов")
         return test_packages
@@ -234,27 +1027,67 @@ def find_package_in_test_repo(test_packages, package_name):
 
 # GIT
 
+# Что нужно из git-репозитория: остальные файлы при checkout не скачиваются
+GIT_SPARSE_PATTERNS = ['APKINDEX', 'APKINDEX.tar.gz', '*.apk']
+
+
+def run_git(*args):
+    return subprocess.run(['git', *args], capture_output=True, text=True)
+
+
 def clone_git_repo(git_url):
+    """Возвращает рабочую копию репозитория из кэша, обновляя её при необходимости
     
-    print(f"Клонируем git репозиторий: {git_url}")
+    Первый запуск: неглубокий клон без содержимого файлов (--filter=blob:none)
+    и sparse checkout только APKINDEX и .apk. Следующие запуски делают
+    git fetch --depth 1 и, если HEAD на сервере не сдвинулся, используют
+    рабочую копию как есть.
+    """
     
-    # Создаём временную папку
-    temp_dir = tempfile.mkdtemp()
+    repo_dir = get_cache_dir('git', cache_key(git_url))
     
     try:
+        if os.path.isdir(os.path.join(repo_dir, '.git')):
+            print(f"Обновляем git репозиторий из кэша: {git_url}")
+            
+            result = run_git('-C', repo_dir, 'fetch', '--depth', '1', 'origin', 'HEAD')
+            if result.returncode != 0:
+                # Сети нет - работаем с тем, что есть
+                print(f"ВНИМАНИЕ: git fetch не удался, используем старую копию: {result.stderr.strip()}")
+                return repo_dir
+            
+            if get_git_head(repo_dir) == run_git('-C', repo_dir, 'rev-parse', 'FETCH_HEAD').stdout.strip():
+                print(f"Не изменился: {repo_dir}\n")
+                return repo_dir
+            
+            result = run_git('-C', repo_dir, 'reset', '--hard', '-q', 'FETCH_HEAD')
+            if result.returncode != 0:
+                print(f"ОШИБКА git: {result.stderr}")
+                return None
+            
+            print(f"Обновлено: {repo_dir}\n")
+            return repo_dir
+        
+        print(f"Клонируем git репозиторий: {git_url}")
+        
         # Запускаем git clone
-        result = subprocess.run(
-            ['git', 'clone', '--depth', '1', git_url, temp_dir],
-            capture_output=True,
-            text=True
-        )
+        result = run_git('clone', '--depth', '1', '--filter=blob:none', '--no-checkout', git_url, repo_dir)
+        if result.returncode != 0:
+            print(f"ОШИБКА git: {result.stderr}")
+            shutil.rmtree(repo_dir, ignore_errors=True)
+            return None
         
+        # Старый git без sparse-checkout просто получит полную копию
+        run_git('-C', repo_dir, 'sparse-checkout', 'set', '--no-cone', *GIT_SPARSE_PATTERNS)
+        
+        result = run_git('-C', repo_dir, 'checkout', '-q')
         if result.returncode != 0:
             print(f"ОШИБКА git: {result.stderr}")
+            shutil.rmtree(repo_dir, ignore_errors=True)
             return None
         
-        print(f"Успешно склонировано в {temp_dir}\n")
-        return temp_dir
+        print(f"Успешно склонировано в {repo_dir}\n")
+        return repo_dir
         
     except FileNotFoundError:
         print("ОШИБКА: Git не установлен")
@@ -264,47 +1097,125 @@ def clone_git_repo(git_url):
         return None
 
 
-def find_files_in_directory(directory, filename):
-    found_files = []
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file == filename or file == filename + '.tar.gz':
-                full_path = os.path.join(root, file)
-                found_files.append(full_path)
-    
-    return found_files
+def get_git_head(repo_dir):
+    """Хэш текущего коммита (или None, если git не ответил)"""
+    result = run_git('-C', repo_dir, 'rev-parse', 'HEAD')
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip()
 
 
-def read_apkindex_from_file(filepath):
-    try:
-        with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-            return f.read()
-    except Exception as e:
-        print(f"ОШИБКА чтения файла: {e}")
+def synthetic_apkindex_path(repository_url, commit):
+    """Где лежит APKINDEX, собранный из .apk для данного репозитория и коммита"""
+    if not commit:
         return None
+    return os.path.join(get_cache_dir('synthetic', cache_key(repository_url, commit)), 'APKINDEX')
+
+
+# Папки, в которых не бывает ни APKINDEX, ни .apk
+SKIP_DIRECTORIES = {'.git', '.hg', '.svn', '__pycache__', 'node_modules'}
 
 
-def find_apk_files(directory):
-    apk_files = []
+def scan_repository_tree(directory):
+    """Один обход дерева (os.scandir): находит и APKINDEX, и .apk файлы
+    
+    Для каждой папки запоминается её mtime и найденное в ней (манифест в кэше).
+    mtime папки меняется, только когда в ней появляются или исчезают записи,
+    поэтому при повторном обходе неизменённые папки не перечитываются.
+    
+    Возвращает {'apkindex': [пути], 'apk': [пути]}.
+    """
+    directory = os.path.abspath(directory)
+    manifest_path = os.path.join(get_cache_dir('scan'), f"{cache_key(directory)}.pickle")
+    try:
+        with open(manifest_path, 'rb') as f:
+            manifest = pickle.load(f)
+    except Exception:
+        manifest = {}
+    
+    new_manifest = {}
+    rescanned = 0
+    found = {'apkindex': [], 'apk': []}
+    stack = [directory]
+    
+    while stack:
+        path = stack.pop()
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            continue
+        
+        entry = manifest.get(path)
+        if entry is None or entry[0] != mtime:
+            rescanned += 1
+            subdirs, apkindex, apk = [], [], []
+            try:
+                with os.scandir(path) as entries:
+                    for item in entries:
+                        if item.is_dir(follow_symlinks=False):
+                            if item.name not in SKIP_DIRECTORIES:
+                                subdirs.append(item.name)
+                        elif item.name in ('APKINDEX', 'APKINDEX.tar.gz'):
+                            apkindex.append(item.name)
+                        elif item.name.endswith('.apk'):
+                            apk.append(item.name)
+            except OSError:
+                continue
+            entry = (mtime, subdirs, apkindex, apk)
+        
+        new_manifest[path] = entry
+        _, subdirs, apkindex, apk = entry
+        found['apkindex'].extend(os.path.join(path, name) for name in apkindex)
+        found['apk'].extend(os.path.join(path, name) for name in apk)
+        stack.extend(os.path.join(path, name) for name in subdirs)
+    
+    if rescanned or len(new_manifest) != len(manifest):
+        try:
+            write_file_atomic(manifest_path, pickle.dumps(new_manifest, protocol=pickle.HIGHEST_PROTOCOL))
+        except OSError as e:
+            print(f"Не удалось сохранить манифест: {e}")
     
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file.endswith('.apk'):
-                full_path = os.path.join(root, file)
-                apk_files.append(full_path)
+    # Ближе к корню - раньше
+    found['apkindex'].sort(key=lambda found_path: (found_path.count(os.sep), found_path))
+    found['apk'].sort()
+    return found
+
+
+def read_apkindex_from_file(filepath, lazy=False):
+    """Разбирает APKINDEX (или APKINDEX.tar.gz) из файла потоком и возвращает индекс
     
-    return apk_files
+    lazy - не разбирать записи сразу (load_apkindex_lazy)
+    """
+    try:
+        with open(filepath, 'rb') as f:
+            if lazy:
+                data = read_apkindex_bytes(f, filepath)
+                if data is None:
+                    print(f"ОШИБКА: В архиве '{filepath}' нет APKINDEX")
+                    return None
+                return load_apkindex_lazy(data)
+            lines = open_apkindex_stream(f, filepath)
+            if lines is None:
+                print(f"ОШИБКА: В архиве '{filepath}' нет APKINDEX")
+                return None
+            return build_package_index(iter_apkindex_records(lines))
+    except Exception as e:
+        print(f"ОШИБКА чтения файла: {e}")
+        return None
 
 
 def read_apk_file(apk_path):  
     print(f"Читаем APK файл: {apk_path}")
     
     try:
-        # APK файл - это tar.gz архив
-        with tarfile.open(apk_path, 'r:gz') as tar:
+        # APK файл - это несколько gzip-потоков подряд (подпись, .PKGINFO, данные),
+        # поэтому читаем потоком и останавливаемся сразу на .PKGINFO -
+        # остальной архив даже не распаковывается
+        with open(apk_path, 'rb') as f:
+            tar = tarfile.open(fileobj=gzip.GzipFile(fileobj=f), mode='r|')
             
             # Ищем файл .PKGINFO внутри
-            for member in tar.getmembers():
+            for member in tar:
                 if member.name == '.PKGINFO':
                     # Читаем его
                     file_content = tar.extractfile(member)
@@ -320,79 +1231,194 @@ def read_apk_file(apk_path):
         return None
 
 
+def read_apk_files(apk_paths, max_workers=None):
+    """Читает .PKGINFO из многих .apk параллельно (в нескольких процессах)
+    
+    Результаты кэшируются по (путь, размер, mtime): при повторном запуске
+    читаются только новые и изменившиеся файлы.
+    """
+    cache_path = os.path.join(get_cache_dir('apk'), f'pkginfo-v{INDEX_CACHE_VERSION}.pickle')
+    try:
+        with open(cache_path, 'rb') as f:
+            cache = pickle.load(f)
+    except Exception:
+        cache = {}
+    
+    records = {}
+    to_read = []
+    for apk_path in apk_paths:
+        apk_path = os.path.abspath(apk_path)
+        stat = os.stat(apk_path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        cached = cache.get(apk_path)
+        if cached and cached[0] == signature:
+            records[apk_path] = cached[1]
+        else:
+            to_read.append((apk_path, signature))
+    
+    if to_read:
+        paths = [apk_path for apk_path, _ in to_read]
+        # Запуск процессов дороже, чем чтение пары файлов
+        if len(paths) < 8:
+            results = [read_apk_file(apk_path) for apk_path in paths]
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(read_apk_file, paths, chunksize=16))
+        
+        for (apk_path, signature), info in zip(to_read, results):
+            records[apk_path] = info
+            cache[apk_path] = (signature, info)
+        
+        try:
+            write_file_atomic(cache_path, pickle.dumps(cache, protocol=pickle.HIGHEST_PROTOCOL))
+        except OSError as e:
+            print(f"Не удалось сохранить кэш: {e}")
+    
+    count_stat('apk: прочитано', len(to_read))
+    count_stat('apk: из кэша', len(records) - len(to_read))
+    print(f"Прочитано .apk: {len(to_read)}, из кэша: {len(records) - len(to_read)}")
+    return [records[os.path.abspath(apk_path)] for apk_path in apk_paths]
+
+
 def parse_pkginfo(text):
     
-    pkg_info = {
-        'name': None,
-        'version': None,
-        'depends': ''
-    }
+    pkg_info = PackageRecord()
     
     dependencies = []
+    provides = []
     for line in text.split('\n'):
         line = line.strip()
         
         if line.startswith('pkgname = '):
-            pkg_info['name'] = line[10:]
+            pkg_info.name = sys.intern(line[10:])
         
         elif line.startswith('pkgver = '):
-            pkg_info['version'] = line[9:]
+            pkg_info.version = line[9:]
         
         elif line.startswith('depend = '):
             dep = line[9:]
             dependencies.append(dep)
+        
+        elif line.startswith('provides = '):
+            provides.append(line[11:])
     
     # В строку всё
     if dependencies:
-        pkg_info['depends'] = ' '.join(dependencies)
+        pkg_info.depends = ' '.join(dependencies)
+    if provides:
+        pkg_info.provides = ' '.join(provides)
     
     return pkg_info
 
 
 # ПАРСИНГ APKINDEX
 
-def find_package_in_apkindex(apkindex_text, package_name, package_version):
+def iter_apkindex_records(lines):
+    """Один проход по APKINDEX: отдаёт по одному пакету (PackageRecord) на блок.
 
-    # Разделяем на блоки (каждый пакет - отдельный блок)
-    blocks = apkindex_text.split('\n\n')
-    
-    found_packages = []
-    
-    for block in blocks:
-        lines = block.strip().split('\n')
-        
-        pkg_name = None
-        pkg_version = None
-        pkg_depends = None
-        
-        for line in lines:
-            if line.startswith('P:'):
-                pkg_name = line[2:].strip()
-            elif line.startswith('V:'):
-                pkg_version = line[2:].strip()
-            elif line.startswith('D:'):
-                pkg_depends = line[2:].strip()
-        
-        # Если это нужный пакет
-        if pkg_name == package_name:
-            pkg_info = {
-                'name': pkg_name,
-                'version': pkg_version,
-                'depends': pkg_depends
-            }
-            found_packages.append(pkg_info)
-    
-    if len(found_packages) == 0:
-        return None
+    lines — текст целиком или любой итерируемый набор строк.
+    """
+    if isinstance(lines, str):
+        lines = lines.split('\n')
+
+    pkg_info = None
+    for line in lines:
+        line = line.strip()
+
+        # Пустая строка - конец блока
+        if not line:
+            if pkg_info and pkg_info.name:
+                yield pkg_info
+            pkg_info = None
+            continue
+
+        if len(line) < 2 or line[1] != ':':
+            continue
+
+        if pkg_info is None:
+            pkg_info = PackageRecord()
+
+        field = line[0]
+        if field == 'P':
+            pkg_info.name = sys.intern(line[2:].strip())
+        elif field == 'V':
+            pkg_info.version = line[2:].strip()
+        elif field == 'D':
+            pkg_info.depends = line[2:].strip()
+        elif field == 'p':
+            pkg_info.provides = line[2:].strip()
+
+    if pkg_info and pkg_info.name:
+        yield pkg_info
+
+
+def build_package_index(records):
+    """Строит индекс пакетов: имя -> [версии] и provides-имя -> [пакеты]
+    
+    Индекс общий для всех режимов (test, http, git) и переиспользуется
+    для любого количества стартовых пакетов.
+    """
+    packages = {}
+    provides = {}
+
+    for pkg_info in records:
+        packages.setdefault(pkg_info['name'], []).append(pkg_info)
+
+        for item in pkg_info.get('provides', '').split():
+            # so:libc.musl-x86_64.so.1=1 -> so:libc.musl-x86_64.so.1
+            provided_name = item.split('=')[0]
+            provides.setdefault(provided_name, []).append(pkg_info)
+
+    # Версии каждого пакета - по возрастанию, чтобы ограничения искать бинарным поиском
+    for versions in packages.values():
+        if len(versions) > 1:
+            versions.sort(key=record_version_key)
+
+    index = {
+        'packages': packages,
+        'provides': provides
+    }
+    
+    # Граф и обратный граф строятся при первом запросе rdeps/diff (get_reverse_index):
+    # обычному запросу deps они не нужны, а стоят в разы дороже самого разбора
+    return index
+
+
+def format_apkindex(records):
+    """Записи о пакетах -> текст в формате APKINDEX (поля P:/V:/D:/p:)"""
+    blocks = []
+    for pkg_info in records:
+        lines = [f"P:{pkg_info['name']}"]
+        if pkg_info['version']:
+            lines.append(f"V:{pkg_info['version']}")
+        if pkg_info['depends']:
+            lines.append(f"D:{pkg_info['depends']}")
+        if pkg_info['provides']:
+            lines.append(f"p:{pkg_info['provides']}")
+        blocks.append('\n'.join(lines) + '\n')
+    return '\n'.join(blocks)
+
+
+def parse_apkindex(apkindex_text):
+    return build_package_index(iter_apkindex_records(apkindex_text))
+
+
+def find_package_in_index(index, package_name, package_version):
+
+    found_packages = index['packages'].get(package_name)
+    
+    if not found_packages:
+        return None
     
-    # Если версия не указана - берём первый
+    # Если версия не указана - берём самую новую
     if not package_version or package_version == '':
-        return found_packages[0]
+        return found_packages[-1]
     
     # Если версия указана - ищем подходящую
-    for pkg in found_packages:
-        if pkg['version'] and pkg['version'].startswith(package_version):
-            return pkg
+    op, version = parse_version_constraint(package_version)
+    pkg = select_version(found_packages, op, version)
+    if pkg:
+        return pkg
     
     # Версия не найдена
     print(f"Версия {package_version} не найдена. Доступные:")
@@ -402,6 +1428,367 @@ def find_package_in_apkindex(apkindex_text, package_name, package_version):
     return None
 
 
+def find_package_in_apkindex(apkindex_text, package_name, package_version):
+    """Разовый поиск по тексту. Для многих поисков используйте parse_apkindex + find_package_in_index"""
+    index = load_apkindex_lazy(apkindex_text.encode('utf-8'))
+    return find_package_in_index(index, package_name, package_version)
+
+
+# ЛЕНИВЫЙ APKINDEX
+
+_PACKAGE_LINE_RE = re.compile(rb'\nP:(\S*)')
+_PROVIDES_LINE_RE = re.compile(rb'\np:([^\n]*)')
+
+
+class LazyRecords(Mapping):
+    """Словарь имя -> [PackageRecord] поверх текста APKINDEX
+    
+    offsets - имя -> смещение (или список смещений) любой строки внутри блока
+    пакета, либо функция, которая построит такую таблицу при первом обращении.
+    Блок разбирается в PackageRecord при первом обращении и запоминается
+    по началу блока (records общий для packages и provides, так что один и тот
+    же блок - один и тот же объект).
+    """
+    
+    def __init__(self, data, offsets, records, sort=False):
+        self.data = data
+        self._offsets = offsets
+        self.records = records
+        self.sort = sort
+        self.decoded = {}
+    
+    @property
+    def offsets(self):
+        if callable(self._offsets):
+            self._offsets = self._offsets()
+        return self._offsets
+    
+    def record(self, position):
+        # Перед P: в блоке могут быть другие поля (C:, A:...) - ищем начало блока
+        start = self.data.rfind(b'\n\n', 0, position) + 2
+        pkg_info = self.records.get(start)
+        if pkg_info is None:
+            end = self.data.find(b'\n\n', position)
+            if end == -1:
+                end = len(self.data)
+            text = self.data[start:end].decode('utf-8', errors='ignore')
+            pkg_info = next(iter_apkindex_records(text))
+            self.records[start] = pkg_info
+        return pkg_info
+    
+    def __getitem__(self, name):
+        found = self.decoded.get(name)
+        if found is None:
+            positions = self.offsets[name]
+            if isinstance(positions, int):
+                found = [self.record(positions)]
+            else:
+                found = [self.record(position) for position in positions]
+                # Версии по возрастанию, как в build_package_index
+                if self.sort:
+                    found.sort(key=record_version_key)
+            self.decoded[name] = found
+        return found
+    
+    def __contains__(self, name):
+        return name in self.offsets
+    
+    def __iter__(self):
+        return iter(self.offsets)
+    
+    def __len__(self):
+        return len(self.offsets)
+
+
+class MergedRecords(Mapping):
+    """Словарь имя -> [PackageRecord] поверх нескольких словарей (merge_indexes)
+    
+    Списки склеиваются в порядке parts при первом обращении к имени.
+    """
+    
+    def __init__(self, parts, sort=False):
+        self.parts = parts
+        self.sort = sort
+        self.decoded = {}
+        self.names = None
+    
+    def __getitem__(self, name):
+        found = self.decoded.get(name)
+        if found is None:
+            found = []
+            for part in self.parts:
+                if name in part:
+                    found.extend(part[name])
+            if not found:
+                raise KeyError(name)
+            if self.sort:
+                found.sort(key=record_version_key)
+            self.decoded[name] = found
+        return found
+    
+    def __contains__(self, name):
+        return any(name in part for part in self.parts)
+    
+    def all_names(self):
+        if self.names is None:
+            self.names = dict.fromkeys(name for part in self.parts for name in part)
+        return self.names
+    
+    def __iter__(self):
+        return iter(self.all_names())
+    
+    def __len__(self):
+        return len(self.all_names())
+
+
+def group_offsets(names, positions):
+    """имя -> смещение; для имён, встречающихся несколько раз, - список смещений"""
+    offsets = dict(zip(names, positions))
+    if len(offsets) < len(names):
+        offsets = {}
+        for name, position in zip(names, positions):
+            if name not in offsets:
+                offsets[name] = position
+            elif isinstance(offsets[name], int):
+                offsets[name] = [offsets[name], position]
+            else:
+                offsets[name].append(position)
+    return offsets
+
+
+def skim_provides(data):
+    """имя из p: -> смещения строк p:, которые его объявляют (см. load_apkindex_lazy)"""
+    names = []
+    positions = []
+    for match in _PROVIDES_LINE_RE.finditer(data):
+        for item in match.group(1).split():
+            names.append(item.split(b'=')[0].decode('utf-8', errors='ignore'))
+            positions.append(match.start() + 1)
+    return group_offsets(names, positions)
+
+
+def load_apkindex_lazy(data):
+    """Индекс по тексту APKINDEX (bytes) без разбора записей
+    
+    Первый проход - два поиска регулярным выражением по всему тексту (строки
+    P:, их смещения и имена), цикла на Python по блокам нет. Таблица provides
+    (строки p:) строится при первом обращении к index['provides'], остальные
+    поля пакета разбираются, когда к нему обратятся (обычно - при обходе графа
+    от одного пакета). Обратный граф заранее не строится.
+    
+    Несколько таких индексов merge_indexes сливает лениво (MergedRecords).
+    """
+    # Строки ищутся как "\nP:", поэтому первой строке тоже нужен перевод строки
+    data = b'\n' + data
+    positions = [match.start() + 1 for match in _PACKAGE_LINE_RE.finditer(data)]
+    names = b'\n'.join(_PACKAGE_LINE_RE.findall(data)).decode('utf-8', errors='ignore').split('\n')
+    packages = group_offsets(names, positions)
+    packages.pop('', None)
+    
+    records = {}
+    return {
+        'packages': LazyRecords(data, packages, records, sort=True),
+        'provides': LazyRecords(data, functools.partial(skim_provides, data), records),
+    }
+
+
+def read_apkindex_bytes(stream, name):
+    """Текст APKINDEX целиком (bytes) из .tar.gz или обычного файла; None если его нет в архиве"""
+    if not name.endswith('.tar.gz'):
+        return stream.read()
+    
+    tar = tarfile.open(fileobj=gzip.GzipFile(fileobj=stream), mode='r|')
+    for member in tar:
+        if member.name == 'APKINDEX':
+            return tar.extractfile(member).read()
+    
+    return None
+
+
+# ВЕРСИИ
+
+# Суффиксы версий Alpine: до "без суффикса" (отрицательные) и после (положительные)
+VERSION_SUFFIX_ORDER = {
+    'alpha': -4, 'beta': -3, 'pre': -2, 'rc': -1,
+    'cvs': 1, 'svn': 2, 'git': 3, 'hg': 4, 'p': 5,
+}
+
+_VERSION_RE = re.compile(r'^(\d+(?:\.\d+)*)([a-z]?)((?:_[a-z]+\d*)*)(?:~[0-9a-f]+)?(?:-r(\d+))?$')
+_VERSION_SUFFIX_RE = re.compile(r'_([a-z]+)(\d*)')
+_DEPENDENCY_RE = re.compile(r'^(!?)([^<>=~]+)(?:(>=|<=|=~|~=|>|<|=|~)(.*))?$')
+
+
+@functools.lru_cache(maxsize=None)
+def version_key(version):
+    """Ключ сортировки версии Alpine: 1.2 < 1.2.1 < 1.10, 1.0_rc1 < 1.0 < 1.0_p1, -r1 < -r2
+    
+    Как в apk-tools, сначала сравниваются все числа, потом буква, суффиксы
+    и ревизия: 1.0 < 1.0a < 1.0.1, а 1.0 без ревизии меньше 1.0-r0.
+    Ключи кэшируются: одна и та же строка версии разбирается один раз.
+    """
+    match = _VERSION_RE.match(version or '')
+    if not match:
+        # Непонятная версия - меньше любой правильной, между собой по строке
+        return ((), '', ((0, 0),), 0, version or '')
+    
+    numbers, letter, suffixes, revision = match.groups()
+    suffix_key = tuple(
+        (VERSION_SUFFIX_ORDER.get(name, 0), int(number or 0))
+        for name, number in _VERSION_SUFFIX_RE.findall(suffixes)
+    )
+    # Конец списка суффиксов = "без суффикса", поэтому 1.0_rc1 < 1.0
+    suffix_key += ((0, 0),)
+    revision = int(revision) if revision is not None else -1
+    return (tuple(int(part) for part in numbers.split('.')), letter, suffix_key, revision, '')
+
+
+def record_version_key(pkg_info):
+    return version_key(pkg_info['version'])
+
+
+def fuzzy_version_match(version, prefix):
+    """~1.2 подходит к 1.2, 1.2.5, 1.2-r3, но не к 1.20"""
+    if not version or not version.startswith(prefix):
+        return False
+    return len(version) == len(prefix) or not version[len(prefix)].isdigit()
+
+
+def version_satisfies(version, op, required):
+    if not op:
+        return True
+    if op == '~':
+        return fuzzy_version_match(version, required)
+    
+    difference = (version_key(version) > version_key(required)) - (version_key(version) < version_key(required))
+    return {
+        '=': difference == 0,
+        '<': difference < 0,
+        '<=': difference <= 0,
+        '>': difference > 0,
+        '>=': difference >= 0,
+    }[op]
+
+
+@functools.lru_cache(maxsize=None)
+def parse_dependency(token):
+    """Разбирает зависимость из D: -> (имя, оператор, версия, конфликт)
+    
+    'musl>=1.2' -> ('musl', '>=', '1.2', False)
+    '!foo'      -> ('foo', '', '', True)  - конфликт, а не зависимость
+    Оператор '=~' / '~=' приводится к '~'.
+    """
+    match = _DEPENDENCY_RE.match(token)
+    if not match:
+        return token, '', '', False
+    
+    conflict, name, op, version = match.groups()
+    if op in ('=~', '~='):
+        op = '~'
+    return name, op or '', version or '', bool(conflict)
+
+
+def parse_version_constraint(package_version):
+    """package_version из конфига: '>=1.2', '<2', '=1.2-r0' или просто '1.2' (= ~1.2)"""
+    package_version = package_version.strip()
+    for op in ('>=', '<=', '=~', '~=', '>', '<', '=', '~'):
+        if package_version.startswith(op):
+            return ('~' if op in ('=~', '~=') else op), package_version[len(op):].strip()
+    return '~', package_version
+
+
+def select_version(candidates, op, version):
+    """Самая новая версия, подходящая под ограничение (candidates отсортированы по возрастанию)
+    
+    Ищем бинарным поиском, а не перебором всех версий.
+    """
+    if not op:
+        return candidates[-1]
+    
+    key = version_key(version)
+    
+    if op in ('>', '>='):
+        best = candidates[-1]
+        return best if version_satisfies(best['version'], op, version) else None
+    
+    if op in ('<', '<='):
+        search = bisect.bisect_left if op == '<' else bisect.bisect_right
+        position = search(candidates, key, key=record_version_key)
+        return candidates[position - 1] if position else None
+    
+    if op == '=':
+        position = bisect.bisect_right(candidates, key, key=record_version_key)
+        if position and record_version_key(candidates[position - 1]) == key:
+            return candidates[position - 1]
+        return None
+    
+    # '~': подходящие версии идут подряд - от пре-релизов (~1.2 подходит
+    # к 1.2_rc1 < 1.2) до последней 1.2.x
+    position = bisect.bisect_left(candidates, key, key=record_version_key)
+    best = None
+    if position and fuzzy_version_match(candidates[position - 1]['version'], version):
+        best = candidates[position - 1]
+    while position < len(candidates) and fuzzy_version_match(candidates[position]['version'], version):
+        best = candidates[position]
+        position += 1
+    return best
+
+
+def provided_version(pkg_info, provided_name):
+    """Версия, с которой пакет предоставляет provided_name (из поля p:)"""
+    for item in pkg_info['provides'].split():
+        name, _, version = item.partition('=')
+        if name == provided_name:
+            return version
+    return ''
+
+
+def select_provider(providers, provided_name, op, version):
+    """Самый новый пакет, предоставляющий имя подходящей версии
+    
+    Сравниваются версия из p:, затем версия самого пакета; при равных версиях
+    выигрывает более приоритетный репозиторий (providers идут в его порядке).
+    """
+    best = None
+    best_key = None
+    for pkg_info in providers:
+        provided = provided_version(pkg_info, provided_name)
+        if op and not version_satisfies(provided, op, version):
+            continue
+        key = (version_key(provided), record_version_key(pkg_info))
+        if best is None or key > best_key:
+            best, best_key = pkg_info, key
+    return best
+
+
+def resolve_dependency(index, token):
+    """Пакет из индекса, который удовлетворяет зависимости token (или None)
+    
+    Виртуальные зависимости (so:..., cmd:..., pc:...) и прочие provides
+    разрешаются через индекс provides в конкретный пакет за одно обращение.
+    Результат запоминается в индексе: одинаковые зависимости (so:libc...)
+    встречаются у тысяч пакетов.
+    """
+    resolved = index.setdefault('resolved', {})
+    if token in resolved:
+        count_stat('индекс: зависимостей (кэш)')
+        return resolved[token]
+    
+    name, op, version, conflict = parse_dependency(token)
+    pkg_info = None
+    
+    if not conflict:
+        candidates = index['packages'].get(name)
+        if candidates:
+            pkg_info = select_version(candidates, op, version)
+        else:
+            providers = index['provides'].get(name)
+            if providers:
+                pkg_info = select_provider(providers, name, op, version)
+    
+    resolved[token] = pkg_info
+    return pkg_info
+
+
 #  ВЫВОД РЕЗУЛЬТАТА 
 
 def print_dependencies(package_info):
@@ -421,9 +1808,13 @@ def print_dependencies(package_info):
     deps_list = depends.split()
     
     for dep in deps_list:
-        # Убираем версии
-        clean_dep = dep.split('>=')[0].split('=')[0].split('<')[0]
-        print(f"  - {clean_dep}")
+        name, op, version, conflict = parse_dependency(dep)
+        if conflict:
+            print(f"  - {name} (конфликт)")
+        elif op:
+            print(f"  - {name} ({op}{version})")
+        else:
+            print(f"  - {name}")
 
 # РАБОТА С ЗАВИСИМОСТЯМИ
 
@@ -437,55 +1828,47 @@ def parse_dependencies(depends_string):
     clean_deps = []
     
     for dep in deps_list:
-        # Убираем версии (>=, =, <)
-        clean_dep = dep.split('>=')[0].split('=')[0].split('<')[0]
-        clean_deps.append(clean_dep)
+        # Убираем версии (>=, <, ~ ...), конфликты (!pkg) - не зависимости
+        name, op, version, conflict = parse_dependency(dep)
+        if not conflict:
+            clean_deps.append(name)
     
     return clean_deps
 
 
-def build_graph_bfs(start_package, get_package_func):
+def build_graph_bfs(start_package, get_package_func, resolve_func=None, on_node=None, quiet=False):
     """Строит граф зависимостей используя BFS (Breadth First Search) — “в ширину” (через очередь)
     
     Получает:
         start_package: имя стартового пакета
         get_package_func: функция которая получает инфо о пакете по имени
+        resolve_func: (необязательно) превращает зависимость из D: (с версией) в имя
+                      узла графа; None - пропустить зависимость
+        on_node: (необязательно) вызывается для каждого узла сразу после обхода:
+                 on_node(package_name, pkg_info, dependencies), pkg_info=None если не найден
+        quiet: не печатать строку на каждый узел
     
     Выдает:
         graph: словарь {package_name: [list of dependencies]}
         visited: множество всех посещённых пакетов
-        cycles: список найденных циклов
+        cycles: список циклов, по одному на каждую компоненту сильной связности
     """
     
-    print(f"\n Строим граф зависимостей для '{start_package}' \n")
+    if not quiet:
+        print(f"\n Строим граф зависимостей для '{start_package}' \n")
     
 
     graph = {}
-    visited = set()
-    in_progress = set()
-    cycles = []
     
-    # Очередь для BFS: (имя_пакета, путь_до_него)
+    # parent[пакет] = кто первым на него сослался. Заодно это множество
+    # уже поставленных в очередь пакетов: проверка за O(1), каждый пакет попадает в очередь один раз
+    parent = {start_package: None}
     queue = deque() #Вот это супер крутая штука, чего только эти ваши питоны не напридумывают
-    queue.append((start_package, []))
+    queue.append(start_package)
     
     # BFS
     while len(queue) > 0:
-        current_package, path = queue.popleft()
-        
-        # Если уже обработали - пропускаем
-        if current_package in visited:
-            continue
-        
-        # Проверяем цикл
-        if current_package in queue :
-            cycle_path = path + [current_package]
-            cycles.append(cycle_path)
-            print(f"ЦИКЛ ОБНАРУЖЕН: {' -> '.join(cycle_path)}")
-            continue
-        
-        # Помечаем что начали обрабатывать
-        in_progress.add(current_package)
+        current_package = queue.popleft()
         
         # Получаем информацию о пакете
         pkg_info = get_package_func(current_package)
@@ -493,175 +1876,1740 @@ def build_graph_bfs(start_package, get_package_func):
         if not pkg_info:
             print(f"Пакет '{current_package}' не найден в репозитории")
             graph[current_package] = []
-            visited.add(current_package)
-            in_progress.remove(current_package)
+            if on_node is not None:
+                on_node(current_package, None, [])
             continue
         
         # Парсим зависимости
         depends_string = pkg_info.get('depends', '')
-        dependencies = parse_dependencies(depends_string)
+        if resolve_func is None:
+            dependencies = parse_dependencies(depends_string)
+        else:
+            dependencies = []
+            for token in depends_string.split():
+                dep = resolve_func(token)
+                if dep is not None and dep not in dependencies:
+                    dependencies.append(dep)
         
         # Сохраняем в граф
         graph[current_package] = dependencies
+        if on_node is not None:
+            on_node(current_package, pkg_info, dependencies)
         
-        if dependencies:
+        if quiet:
+            pass
+        elif dependencies:
             print(f"{current_package}: {dependencies}")
         else:
             print(f"{current_package}: (нет зависимостей)")
         
         # Добавляем зависимости в очередь
-        new_path = path + [current_package]
         for dep in dependencies:
-            if dep not in visited:
-                queue.append((dep, new_path))
-        
-        # Помечаем как обработанный
-        visited.add(current_package)
-        in_progress.remove(current_package)
+            if dep not in parent:
+                parent[dep] = current_package
+                queue.append(dep)
+    
+    visited = set(graph)
+    if STATS is not None:
+        STATS.count('граф: узлов', len(graph))
+        STATS.count('граф: рёбер', sum(len(deps) for deps in graph.values()))
+    
+    # Циклы ищем отдельно, за линейное время
+    cycles = find_cycles(graph)
+    if not quiet:
+        for cycle in cycles:
+            print(f"ЦИКЛ ОБНАРУЖЕН: {' -> '.join(cycle)}")
     
     return graph, visited, cycles
 
 
-def print_graph(graph, cycles):
+async def build_graph_async(start_package, get_package_func, resolve_func=None,
+                            max_concurrency=16, on_node=None, quiet=False):
+    """Асинхронный BFS: все пакеты текущего уровня запрашиваются параллельно
     
-    print("\n" + "="*50)
-    print("ГРАФ ЗАВИСИМОСТЕЙ")
-    print("="*50)
+    Нужен, когда get_package_func медленный (скачивание .apk, удалённый индекс):
+    синхронный build_graph_bfs ждёт каждый пакет по очереди, а здесь уровень
+    из N пакетов стоит примерно как самый медленный запрос из них.
     
-    for package, deps in graph.items():
-        if deps:
-            print(f"{package} -> {', '.join(deps)}")
-        else:
-            print(f"{package} -> (нет зависимостей)")
+    get_package_func и resolve_func могут быть как async-функциями, так и
+    обычными - обычные запускаются в пуле потоков. Одновременно идёт не больше
+    max_concurrency запросов, каждый пакет запрашивается один раз. Результат -
+    как у build_graph_bfs, граф в том же порядке обхода.
+    """
+    if not quiet:
+        print(f"\n Строим граф зависимостей для '{start_package}' (параллельно) \n")
     
-    print("\n" + "="*50)
-    print(f"Всего пакетов в графе: {len(graph)}")
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    semaphore = asyncio.Semaphore(max_concurrency)
     
-    if cycles:
-        print(f"Найдено циклов: {len(cycles)}")
-        print("\nЦиклические зависимости:")
-        for i, cycle in enumerate(cycles, 1):
-            print(f"  {i}. {' -> '.join(cycle)}")
-    else:
-        print("Циклических зависимостей не обнаружено ")
+    async def call(func, arg):
+        if inspect.iscoroutinefunction(func):
+            return await func(arg)
+        return await loop.run_in_executor(executor, func, arg)
     
-    print("="*50 + "\n")
+    async def fetch(package):
+        async with semaphore:
+            return await call(get_package_func, package)
+    
+    resolve_is_async = inspect.iscoroutinefunction(resolve_func)
+    graph = {}
+    parent = {start_package: None}
+    frontier = [start_package]
+    try:
+        while frontier:
+            # Уровень целиком: запросы идут одновременно, обрабатываем в порядке обхода
+            infos = await asyncio.gather(*(fetch(package) for package in frontier))
+            next_frontier = []
+            for current_package, pkg_info in zip(frontier, infos):
+                if not pkg_info:
+                    print(f"Пакет '{current_package}' не найден в репозитории")
+                    graph[current_package] = []
+                    if on_node is not None:
+                        on_node(current_package, None, [])
+                    continue
+                
+                depends_string = pkg_info.get('depends', '')
+                if resolve_func is None:
+                    dependencies = parse_dependencies(depends_string)
+                else:
+                    dependencies = []
+                    for token in depends_string.split():
+                        # resolve_func обычно дешёвый - синхронный зовём прямо здесь
+                        dep = await resolve_func(token) if resolve_is_async else resolve_func(token)
+                        if dep is not None and dep not in dependencies:
+                            dependencies.append(dep)
+                
+                graph[current_package] = dependencies
+                if on_node is not None:
+                    on_node(current_package, pkg_info, dependencies)
+                
+                if quiet:
+                    pass
+                elif dependencies:
+                    print(f"{current_package}: {dependencies}")
+                else:
+                    print(f"{current_package}: (нет зависимостей)")
+                
+                for dep in dependencies:
+                    if dep not in parent:
+                        parent[dep] = current_package
+                        next_frontier.append(dep)
+            frontier = next_frontier
+    finally:
+        executor.shutdown(wait=False)
+    
+    visited = set(graph)
+    cycles = find_cycles(graph)
+    if not quiet:
+        for cycle in cycles:
+            print(f"ЦИКЛ ОБНАРУЖЕН: {' -> '.join(cycle)}")
+    
+    return graph, visited, cycles
 
 
+def build_graph_concurrent(start_package, get_package_func, resolve_func=None, max_concurrency=16,
+                           on_node=None, quiet=False):
+    """build_graph_async для обычного (не async) кода"""
+    return asyncio.run(build_graph_async(start_package, get_package_func, resolve_func,
+                                         max_concurrency, on_node, quiet))
+
+
+def get_path(parent, package):
+    """Путь от стартового пакета до package по ссылкам parent"""
+    path = []
+    while package is not None:
+        path.append(package)
+        package = parent[package]
+    path.reverse()
+    return path
 
-#  ГЛАВНАЯ ФУНКЦИЯ 
 
-def build_dependency_graph(config):
-    """Главная функция - строит граф зависимостей"""
+def find_strongly_connected_components(graph):
+    """Компоненты сильной связности графа-словаря (алгоритм Тарьяна, O(V + E))
     
-    package_name = config['package_name']
-    package_version = config.get('package_version', '')
-    repository_url = config['repository_url']
-    repo_mode = config['repo_mode']
+    Возвращает списки имён в обратном топологическом порядке: компонента
+    идёт раньше всех, кто от неё зависит.
+    """
+    compact = CompactGraph.from_dict(graph)
+    names = compact.names
+    return [
+        [names[node] for node in component]
+        for component in compact.strongly_connected_components()
+    ]
+
+
+def find_cycle_in_component(graph, component):
+    """Один конкретный цикл внутри компоненты: BFS от первой вершины обратно к ней"""
+    members = set(component)
+    start = component[0]
+    parent = {start: None}
+    queue = deque([start])
     
-    print(f"Пакет: {package_name}")
-    if package_version:
-        print(f"Версия: {package_version}")
-    print(f"Репозиторий: {repository_url}")
-    print(f"Режим: {repo_mode}\n")
+    while queue:
+        node = queue.popleft()
+        for dep in graph.get(node, ()):
+            if dep == start:
+                return get_path(parent, node) + [start]
+            if dep in members and dep not in parent:
+                parent[dep] = node
+                queue.append(dep)
     
-    # Определяем тип репозитория
-    repo_type = check_repo_type(repository_url, repo_mode)
-    print(f"Тип репозитория: {repo_type}\n")
+    return component + [start]
+
+
+def find_cycles(graph):
+    """Все циклические зависимости: по одному циклу на компоненту сильной связности"""
+    cycles = []
     
-    temp_dir = None
-    test_packages = None
-    apkindex_text = None
+    for component in find_strongly_connected_components(graph):
+        node = component[0]
+        # Компонента из одной вершины - цикл, только если пакет зависит сам от себя
+        if len(component) == 1 and node not in graph.get(node, ()):
+            continue
+        cycles.append(find_cycle_in_component(graph, component))
     
-    try:
-        #  ТЕСТОВЫЙ РЕЖИМ 
-        if repo_type == 'test':
-            print(" ТЕСТОВЫЙ РЕЖИМ \n")
-            
-            test_packages = read_test_repo(repository_url)
-            if not test_packages:
-                return
-            
-            def get_package_test(pkg_name):
-                return find_package_in_test_repo(test_packages, pkg_name)
-            
-            graph, visited, cycles = build_graph_bfs(package_name, get_package_test)
-            print_graph(graph, cycles)
+    return cycles
+
+
+# КОМПАКТНЫЙ ГРАФ
+
+class CompactGraph:
+    """Граф зависимостей в компактном виде (CSR)
+    
+    names   - таблица имён (строки интернированы), id пакета = индекс в ней
+    ids     - имя -> id
+    offsets - зависимости пакета i лежат в edges[offsets[i]:offsets[i + 1]]
+    edges   - id зависимостей подряд, array('I') по 4 байта на ребро
+    
+    Вместо словаря со списками строк - два плоских массива чисел, поэтому
+    граф целого репозитория занимает в несколько раз меньше памяти.
+    """
+    __slots__ = ('names', 'ids', 'offsets', 'edges')
+    
+    def __init__(self, names, offsets, edges, ids=None):
+        self.names = names
+        self.ids = ids if ids is not None else {name: i for i, name in enumerate(names)}
+        self.offsets = offsets
+        self.edges = edges
+    
+    @classmethod
+    def from_dict(cls, graph):
+        """Из словаря {пакет: [зависимости]} (как возвращает build_graph_bfs)"""
+        names = [sys.intern(name) for name in graph]
+        ids = {name: i for i, name in enumerate(names)}
         
-        #  HTTP РЕПОЗИТОРИЙ 
-        elif repo_type == 'http':
-            print(" HTTP РЕПОЗИТОРИЙ \n")
-            
-            apkindex_text = download_apkindex_http(repository_url)
-            if not apkindex_text:
-                return
-            
-            # Функция для получения пакета из APKINDEX
-            def get_package_http(pkg_name):
-                return find_package_in_apkindex(apkindex_text, pkg_name, '')
-            
-            # Строим граф
-            graph, visited, cycles = build_graph_bfs(package_name, get_package_http)
-            print_graph(graph, cycles)
+        # Зависимости, которых нет среди ключей, тоже становятся вершинами
+        for deps in graph.values():
+            for dep in deps:
+                if dep not in ids:
+                    ids[dep] = len(names)
+                    names.append(sys.intern(dep))
+        
+        offsets = array('I', [0])
+        edges = array('I')
+        for deps in graph.values():
+            edges.extend(ids[dep] for dep in deps)
+            offsets.append(len(edges))
+        
+        # У вершин-листьев зависимостей нет
+        offsets.extend([len(edges)] * (len(names) + 1 - len(offsets)))
+        
+        return cls(names, offsets, edges, ids)
+    
+    def __len__(self):
+        return len(self.names)
+    
+    def edge_count(self):
+        return len(self.edges)
+    
+    def dependencies(self, node_id):
+        return self.edges[self.offsets[node_id]:self.offsets[node_id + 1]]
+    
+    def to_dict(self):
+        names = self.names
+        return {
+            names[i]: [names[dep] for dep in self.dependencies(i)]
+            for i in range(len(names))
+        }
+    
+    def reverse(self):
+        """Обратный граф (кто зависит от пакета) за O(V + E), подсчётом"""
+        count = len(self.names)
+        offsets = array('I', [0]) * (count + 1)
+        for dep in self.edges:
+            offsets[dep + 1] += 1
+        for i in range(count):
+            offsets[i + 1] += offsets[i]
+        
+        edges = array('I', [0]) * len(self.edges)
+        position = array('I', offsets)
+        for node in range(count):
+            for dep in self.dependencies(node):
+                edges[position[dep]] = node
+                position[dep] += 1
+        
+        return CompactGraph(self.names, offsets, edges, self.ids)
+    
+    def closure(self, start_ids):
+        """Все вершины, достижимые из start_ids (BFS), вместе с глубиной: {id: depth}"""
+        offsets = self.offsets
+        edges = self.edges
+        depth = {}
+        queue = deque()
+        for start in start_ids:
+            if start not in depth:
+                depth[start] = 0
+                queue.append(start)
+        
+        while queue:
+            node = queue.popleft()
+            next_depth = depth[node] + 1
+            for position in range(offsets[node], offsets[node + 1]):
+                dep = edges[position]
+                if dep not in depth:
+                    depth[dep] = next_depth
+                    queue.append(dep)
         
-        #  GIT РЕПОЗИТОРИЙ 
-        elif repo_type == 'git':
-            print(" GIT РЕПОЗИТОРИЙ \n")
-            temp_dir = clone_git_repo(repository_url)
-            if not temp_dir:
-                return
+        return depth
+    
+    def strongly_connected_components(self, nodes=None):
+        """Алгоритм Тарьяна без рекурсии на массивах, O(V + E)
+        
+        Компоненты (списки id) идут в обратном топологическом порядке:
+        компонента раньше всех, кто от неё зависит.
+        
+        nodes - множество id: тогда ищем только в подграфе на этих вершинах.
+        """
+        count = len(self.names)
+        offsets = self.offsets
+        edges = self.edges
+        roots = range(count) if nodes is None else sorted(nodes)
+        
+        index_of = array('i', [-1]) * count
+        lowlink = array('i', [0]) * count
+        on_stack = bytearray(count)
+        stack = []
+        components = []
+        counter = 0
+        
+        for root in roots:
+            if index_of[root] != -1:
+                continue
             
-            # Ищем APKINDEX
-            apkindex_files = find_files_in_directory(temp_dir, 'APKINDEX')
+            index_of[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = 1
+            # Стек обхода: вершина и позиция её следующего ребра
+            work_nodes = [root]
+            work_positions = [offsets[root]]
             
-            if apkindex_files:
-                print(f"Найден APKINDEX: {apkindex_files[0]}\n")
-                apkindex_text = read_apkindex_from_file(apkindex_files[0])
-                
-                if apkindex_text:
-                    def get_package_git(pkg_name):
-                        return find_package_in_apkindex(apkindex_text, pkg_name, '')
-                    
-                    graph, visited, cycles = build_graph_bfs(package_name, get_package_git)
-                    print_graph(graph, cycles)
-            else:
-                print("APKINDEX не найден — ищем .apk файлы...\n")
-                apk_files = find_apk_files(temp_dir)
-                if not apk_files:
-                    print(".apk файлы не найдены, нечего анализировать.")
-                    return
-    
-                print(f"Найдено .apk файлов: {len(apk_files)}\n")
-                
-                # Собираем пакеты
-                all_packages = {}
-                for apk in apk_files:
-                    info = read_apk_file(apk)
-                    if info and info['name']:
-                        all_packages[info['name']] = info
+            while work_nodes:
+                node = work_nodes[-1]
+                position = work_positions[-1]
+                end = offsets[node + 1]
+                descended = False
                 
-                if not all_packages:
-                    print("⚠️ Не удалось извлечь информацию из .apk файлов.")
-                    return
+                while position < end:
+                    dep = edges[position]
+                    position += 1
+                    if nodes is not None and dep not in nodes:
+                        continue
+                    if index_of[dep] == -1:
+                        work_positions[-1] = position
+                        index_of[dep] = lowlink[dep] = counter
+                        counter += 1
+                        stack.append(dep)
+                        on_stack[dep] = 1
+                        work_nodes.append(dep)
+                        work_positions.append(offsets[dep])
+                        descended = True
+                        break
+                    if on_stack[dep] and index_of[dep] < lowlink[node]:
+                        lowlink[node] = index_of[dep]
                 
-                print(f" Собрано {len(all_packages)} пакетов из .apk\n")
-                
-                # Функция получения пакета из собранных данных
-                def get_package_from_apk(pkg_name):
-                    return all_packages.get(pkg_name, None)
+                if descended:
+                    continue
                 
-                # Строим граф зависимостей
-                graph, visited, cycles = build_graph_bfs(package_name, get_package_from_apk)
-                print_graph(graph, cycles)
-                    
-        else:
-            print("ОШИБКА: Неизвестный тип репозитория")
-            return
+                # Все зависимости node обработаны
+                work_nodes.pop()
+                work_positions.pop()
+                if work_nodes:
+                    caller = work_nodes[-1]
+                    if lowlink[node] < lowlink[caller]:
+                        lowlink[caller] = lowlink[node]
                 
-    finally:
-        # Удаляем временную папку если создавали
-        if temp_dir and os.path.exists(temp_dir):
-                        shutil.rmtree(temp_dir)
+                if lowlink[node] == index_of[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = 0
+                        component.append(member)
+                        if member == node:
+                            break
+                    # В порядке обнаружения: первой идёт вершина, с которой вошли в компоненту
+                    component.reverse()
+                    components.append(component)
+        
+        return components
+
+
+# ВЕСЬ РЕПОЗИТОРИЙ
+
+def build_full_graph(index, names=None):
+    """CompactGraph всех пакетов индекса сразу (а не только достижимых из одного пакета)
+    
+    names - имена, которые должны получить id 0, 1, 2... в этом порядке
+    (чтобы id совпадали с графом другого снимка); лишние станут листьями.
+    
+    Зависимость, которой нет среди имён пакетов, ищется в provides
+    (so:..., cmd:...) и заменяется на пакет, который её предоставляет.
+    Неразрешимые зависимости остаются вершинами-листьями со своим именем.
+    """
+    graph = dict.fromkeys(names, ()) if names else {}
+    
+    for name in index['packages']:
+        pkg_info = find_package_in_index(index, name, '')
+        deps = []
+        for token in pkg_info.get('depends', '').split():
+            provider = resolve_dependency(index, token)
+            if provider is not None:
+                dep = provider['name']
+            else:
+                dep, op, version, conflict = parse_dependency(token)
+                if conflict:
+                    continue
+            if dep not in deps:
+                deps.append(dep)
+        graph[name] = deps
+    
+    return CompactGraph.from_dict(graph)
+
+
+def _compute_closures(compact, closure_bits, depth, cyclic, nodes=None):
+    """Считает замыкания для вершин nodes (или всех) на месте в closure_bits/depth/cyclic
+    
+    Граф сжимается по компонентам сильной связности (циклы), получается DAG.
+    Тарьян отдаёт компоненты так, что зависимости идут раньше зависимых, поэтому
+    замыкание компоненты = её вершины + уже посчитанные замыкания соседей.
+    Для соседей вне nodes берутся уже готовые значения из closure_bits.
+    """
+    offsets = compact.offsets
+    edges = compact.edges
+    
+    for members in compact.strongly_connected_components(nodes):
+        member_set = set(members)
+        bits = 0
+        longest = 0
+        in_cycle = len(members) > 1
+        
+        for member in members:
+            bits |= 1 << member
+            for position in range(offsets[member], offsets[member + 1]):
+                dep = edges[position]
+                if dep in member_set:
+                    in_cycle = True
+                    continue
+                bits |= closure_bits[dep]
+                if depth[dep] + 1 > longest:
+                    longest = depth[dep] + 1
+        
+        # Члены одной компоненты делят один и тот же int
+        for member in members:
+            closure_bits[member] = bits
+            depth[member] = longest
+            cyclic[member] = in_cycle
+
+
+def compute_all_closures(compact):
+    """Транзитивные замыкания и глубина для всех пакетов за один проход
+    
+    Замыкания хранятся битовыми множествами (int) по id пакетов, объединение - одно OR.
+    Бит самого пакета в множестве есть всегда (он нужен зависимым), поправка на
+    пакеты вне циклов делается при чтении - см. closure_size и get_closure.
+    
+    Вместо N отдельных BFS - O(V + E) объединений битсетов.
+    
+    Результат по каждому id пакета:
+        closure_bits - битсет замыкания
+        depth        - длина самой длинной цепочки зависимостей (в компонентах)
+        cyclic       - 1, если пакет в цикле (и поэтому в собственном замыкании)
+    """
+    count = len(compact)
+    closure_bits = [0] * count
+    depth = array('I', [0]) * count
+    cyclic = bytearray(count)
+    _compute_closures(compact, closure_bits, depth, cyclic)
+    
+    return {
+        'graph': compact,
+        'closure_bits': closure_bits,
+        'depth': depth,
+        'cyclic': cyclic,
+    }
+
+
+def closure_size(closures, name):
+    """Сколько пакетов транзитивно нужно пакету name (без него самого, если он не в цикле)"""
+    node = closures['graph'].ids[name]
+    size = closures['closure_bits'][node].bit_count()
+    return size if closures['cyclic'][node] else size - 1
+
+
+def closure_depth(closures, name):
+    return closures['depth'][closures['graph'].ids[name]]
+
+
+def get_closure(closures, name):
+    """Имена всех пакетов из транзитивного замыкания name"""
+    compact = closures['graph']
+    node = compact.ids[name]
+    bits = closures['closure_bits'][node]
+    if not closures['cyclic'][node]:
+        bits &= ~(1 << node)
+    
+    result = []
+    while bits:
+        lowest = bits & -bits
+        result.append(compact.names[lowest.bit_length() - 1])
+        bits ^= lowest
+    return result
+
+
+def analyze_whole_repository(index, top=20):
+    """Замыкания для всех пакетов репозитория и самые востребованные библиотеки"""
+    
+    print(f"\n Анализируем весь репозиторий: {len(index['packages'])} пакетов \n")
+    
+    compact = get_full_graph(index)
+    closures = compute_all_closures(compact)
+    # Кто сильнее всего нужен другим - это замыкания обратного графа
+    reverse_closures = compute_all_closures(compact.reverse())
+    
+    names = compact.names
+    cycles = [component for component in compact.strongly_connected_components() if len(component) > 1]
+    
+    print("="*50)
+    print(f"Пакетов: {len(compact)}, рёбер: {compact.edge_count()}, циклов: {len(cycles)}")
+    
+    print(f"\nСамые тяжёлые пакеты (больше всего зависимостей), топ {top}:")
+    heaviest = sorted(names, key=lambda name: closure_size(closures, name), reverse=True)
+    for name in heaviest[:top]:
+        print(f"  {name}: {closure_size(closures, name)} пакетов, глубина {closure_depth(closures, name)}")
+    
+    print(f"\nСамые востребованные пакеты (больше всего зависимых), топ {top}:")
+    popular = sorted(names, key=lambda name: closure_size(reverse_closures, name), reverse=True)
+    for name in popular[:top]:
+        print(f"  {name}: нужен {closure_size(reverse_closures, name)} пакетам")
+    
+    print("="*50 + "\n")
+    return closures
+
+
+# ПОРЯДОК УСТАНОВКИ
+
+def install_plan(graph):
+    """Порядок установки, волны и самые длинные цепочки зависимостей, O(V + E)
+    
+    graph - словарь {пакет: [зависимости]}, как из build_graph_bfs. Пакеты
+    одного цикла (компонента сильной связности) ставятся вместе, поэтому
+    считаем по конденсации: Тарьян уже отдаёт компоненты так, что все
+    зависимости компоненты идут раньше неё - это и есть порядок установки.
+    
+    Возвращает словарь:
+        order     - все пакеты в порядке установки (зависимости раньше)
+        waves     - списки пакетов, которые можно ставить параллельно;
+                    волна пакета = длина самой длинной цепочки под ним
+        depth     - {пакет: длина самой длинной цепочки зависимостей}
+        exits     - {пакет: (откуда, куда) - ребро, по которому цепочка выходит
+                    из компоненты пакета, или None}
+        component - {пакет: номер компоненты}
+        cycles    - компоненты из нескольких пакетов (ставятся одним шагом)
+        graph     - исходный граф (для critical_path внутри циклов)
+    """
+    compact = CompactGraph.from_dict(graph)
+    names = compact.names
+    components = compact.strongly_connected_components()
+    
+    component_of = array('I', [0]) * len(names)
+    for c, component in enumerate(components):
+        for node in component:
+            component_of[node] = c
+    
+    # Зависимости компоненты уже посчитаны - они раньше в списке
+    level = array('I', [0]) * len(components)
+    exit_edge = [None] * len(components)
+    for c, component in enumerate(components):
+        best = -1
+        for node in component:
+            for dep in compact.dependencies(node):
+                d = component_of[dep]
+                if d != c and (best < 0 or level[d] > level[best]):
+                    best = d
+                    exit_edge[c] = (names[node], names[dep])
+        if best >= 0:
+            level[c] = level[best] + 1
+    
+    waves = [[] for _ in range(max(level, default=-1) + 1)]
+    depth = {}
+    exits = {}
+    component = {}
+    for c, members in enumerate(components):
+        for node in members:
+            waves[level[c]].append(names[node])
+            depth[names[node]] = level[c]
+            exits[names[node]] = exit_edge[c]
+            component[names[node]] = c
+    
+    return {
+        'order': [names[node] for members in components for node in members],
+        'waves': waves,
+        'depth': depth,
+        'exits': exits,
+        'component': component,
+        'cycles': [[names[node] for node in members]
+                   for members in components if len(members) > 1],
+        'graph': graph,
+    }
+
+
+def path_in_component(plan, source, target):
+    """Кратчайший путь source -> target по рёбрам внутри одной компоненты"""
+    component = plan['component']
+    parent = {source: None}
+    queue = deque([source])
+    while queue:
+        node = queue.popleft()
+        if node == target:
+            break
+        for dep in plan['graph'].get(node, ()):
+            if dep not in parent and component.get(dep) == component[source]:
+                parent[dep] = node
+                queue.append(dep)
+    
+    path = []
+    while target is not None:
+        path.append(target)
+        target = parent[target]
+    return path[::-1]
+
+
+def critical_path(plan, package_name):
+    """Самая длинная цепочка зависимостей от пакета вниз: [пакет, его зависимость, ...]
+    
+    Каждый соседний шаг - настоящее ребро графа; внутри цикла цепочка идёт
+    по пакетам цикла до того, у которого есть ребро наружу.
+    """
+    path = [package_name]
+    while plan['exits'][package_name] is not None:
+        source, target = plan['exits'][package_name]
+        path.extend(path_in_component(plan, package_name, source)[1:])
+        path.append(target)
+        package_name = target
+    return path
+
+
+# ИЗМЕНЕНИЯ МЕЖДУ СНИМКАМИ
+
+def dependency_names(compact, name):
+    node = compact.ids.get(name)
+    if node is None:
+        return []
+    names = compact.names
+    return [names[dep] for dep in compact.dependencies(node)]
+
+
+def diff_indexes(old_index, new_index):
+    """Разница двух снимков репозитория на уровне записей и рёбер
+    
+    Возвращает added/removed (пакеты), updated (сменилась версия)
+    и edges: {пакет: (добавленные зависимости, удалённые зависимости)}.
+    Зависимости сравниваются уже разрешёнными (после provides), поэтому
+    смена поставщика so:... тоже видна как изменение ребра.
+    """
+    old_packages = old_index['packages']
+    new_packages = new_index['packages']
+    old_graph = get_full_graph(old_index)
+    new_graph = get_full_graph(new_index)
+    
+    added = [name for name in new_packages if name not in old_packages]
+    removed = [name for name in old_packages if name not in new_packages]
+    updated = []
+    edges = {}
+    
+    for name, versions in new_packages.items():
+        if name in old_packages:
+            if old_packages[name][-1]['version'] != versions[-1]['version']:
+                updated.append(name)
+            old_deps = set(dependency_names(old_graph, name))
+        else:
+            old_deps = set()
+        
+        new_deps = set(dependency_names(new_graph, name))
+        if old_deps != new_deps:
+            edges[name] = (sorted(new_deps - old_deps), sorted(old_deps - new_deps))
+    
+    for name in removed:
+        edges[name] = ([], sorted(dependency_names(old_graph, name)))
+    
+    return {
+        'added': added,
+        'removed': removed,
+        'updated': updated,
+        'edges': edges,
+    }
+
+
+def update_closures(old_closures, new_index, changed_names):
+    """Замыкания нового снимка, пересчитанные только там, где нужно
+    
+    Новый граф строится с теми же id пакетов, что и старый (новые пакеты - в конец),
+    поэтому готовые битсеты старого снимка остаются верными. Пересчитываются
+    только пакеты из changed_names и все, кто от них транзитивно зависит:
+    работа пропорциональна размеру изменения, а не репозитория.
+    
+    Возвращает (новые замыкания, множество имён пересчитанных пакетов).
+    """
+    old_graph = old_closures['graph']
+    compact = build_full_graph(new_index, old_graph.names)
+    old_count = len(old_graph)
+    added_count = len(compact) - old_count
+    
+    closure_bits = list(old_closures['closure_bits']) + [0] * added_count
+    depth = array('I', old_closures['depth'])
+    depth.extend([0] * added_count)
+    cyclic = bytearray(old_closures['cyclic']) + bytearray(added_count)
+    
+    # Кто транзитивно зависит от изменившихся - по обратному индексу нового снимка
+    reverse = get_reverse_index(new_index)
+    start = [reverse.ids[name] for name in changed_names if name in reverse.ids]
+    affected = {compact.ids[reverse.names[node]] for node in reverse.closure(start)}
+    affected.update(compact.ids[name] for name in changed_names if name in compact.ids)
+    # Новые вершины ещё ни разу не считались
+    affected.update(range(old_count, len(compact)))
+    
+    _compute_closures(compact, closure_bits, depth, cyclic, affected)
+    
+    closures = {
+        'graph': compact,
+        'closure_bits': closure_bits,
+        'depth': depth,
+        'cyclic': cyclic,
+    }
+    return closures, {compact.names[node] for node in affected}
+
+
+def index_cache_dir(repository_url, arch):
+    return get_cache_dir('apkindex', cache_key(repository_url.rstrip('/'), arch))
+
+
+def load_previous_snapshot(config):
+    """Предыдущий снимок индекса и его замыкания: (индекс, замыкания, папка кэша)
+    
+    Берётся из параметра old_index (путь к APKINDEX) или из кэша HTTP-репозитория:
+    при скачивании изменившегося индекса старый сохраняется как index.prev.pickle.
+    
+    При нескольких репозиториях (или arch) предыдущие снимки каждого сливаются
+    в том же порядке, что и текущий индекс; у репозитория без предыдущего снимка
+    берётся текущий. Замыкания тогда считаются заново и в кэш не пишутся.
+    """
+    old_path = config.get('old_index', '').strip()
+    if old_path:
+        return read_apkindex_from_file(old_path), None, None
+    
+    if check_repo_type(config['repository_url'], config['repo_mode']) != 'http':
+        print("ОШИБКА: Без old_index сравнение работает только для HTTP репозитория")
+        return None, None, None
+    
+    arches = config.get('arch', '').split() or ['x86_64']
+    cache_dirs = [
+        index_cache_dir(repository_url, arch)
+        for repository_url in config['repository_url'].split()
+        for arch in arches
+    ]
+    
+    if len(cache_dirs) == 1:
+        cache_dir = cache_dirs[0]
+        old_index = load_cached_index(cache_dir, 'index.prev.pickle')
+        old_closures = load_cached_index(cache_dir, 'closures.prev.pickle')
+        return old_index, old_closures, cache_dir
+    
+    old_indexes = []
+    has_previous = False
+    for cache_dir in cache_dirs:
+        old_index = load_cached_index(cache_dir, 'index.prev.pickle')
+        if old_index is not None:
+            has_previous = True
+        else:
+            old_index = load_cached_index(cache_dir)
+        if old_index is not None:
+            old_indexes.append(old_index)
+    
+    if not has_previous:
+        return None, None, None
+    return merge_indexes(old_indexes), None, None
+
+
+def print_snapshot_diff(diff, old_closures, closures, recomputed):
+    
+    print("\n" + "="*50)
+    print("ИЗМЕНЕНИЯ РЕПОЗИТОРИЯ")
+    print("="*50)
+    
+    for title, names in (('Добавлены', diff['added']), ('Удалены', diff['removed']), ('Новые версии', diff['updated'])):
+        if names:
+            print(f"{title}: {', '.join(sorted(names))}")
+    
+    print("\nРёбра:")
+    if not diff['edges']:
+        print("  (без изменений)")
+    for name in sorted(diff['edges']):
+        added, removed = diff['edges'][name]
+        for dep in added:
+            print(f"  + {name} -> {dep}")
+        for dep in removed:
+            print(f"  - {name} -> {dep}")
+    
+    print("\nЗамыкания:")
+    old_ids = old_closures['graph'].ids
+    changed = 0
+    for name in sorted(recomputed):
+        new_size = closure_size(closures, name)
+        old_size = closure_size(old_closures, name) if name in old_ids else 0
+        if new_size != old_size:
+            changed += 1
+            print(f"  {name}: {old_size} -> {new_size}")
+    
+    print("\n" + "="*50)
+    print(f"Пересчитано замыканий: {len(recomputed)} из {len(closures['graph'])}, изменилось: {changed}")
+    print("="*50 + "\n")
+
+
+def run_snapshot_diff(config, index):
+    """Сравнивает текущий индекс с предыдущим снимком и обновляет замыкания"""
+    
+    old_index, old_closures, cache_dir = load_previous_snapshot(config)
+    if old_index is None:
+        print("Предыдущего снимка нет - сравнивать не с чем")
+        return None
+    
+    # Первый запуск для этого снимка - замыкания старого считаем целиком
+    if old_closures is None:
+        old_closures = compute_all_closures(get_full_graph(old_index))
+    
+    diff = diff_indexes(old_index, index)
+    changed_names = set(diff['edges']) | set(diff['added']) | set(diff['removed'])
+    closures, recomputed = update_closures(old_closures, index, changed_names)
+    
+    print_snapshot_diff(diff, old_closures, closures, recomputed)
+    
+    # Следующее сравнение начнётся с этих замыканий
+    if cache_dir:
+        try:
+            write_file_atomic(
+                os.path.join(cache_dir, 'closures.pickle'),
+                pickle.dumps(closures, protocol=pickle.HIGHEST_PROTOCOL)
+            )
+        except OSError as e:
+            print(f"Не удалось сохранить кэш: {e}")
+    
+    return closures
+
+
+# БИНАРНЫЙ ИНДЕКС
+
+# Заголовок: магия, версия формата, порядок байт (1 - little), пакетов, рёбер,
+# размер хэш-таблицы, длина таблицы строк. Дальше секции подряд:
+#   name_offsets[count + 1], version_offsets[count + 1] - границы строк в таблице
+#   hash[hash_size]   - открытая адресация по crc32(имя), в ячейке id + 1 (0 - пусто)
+#   offsets[count + 1], edges[edge_count] - CSR, как в CompactGraph
+#   flags[count]      - 1 если пакет есть в репозитории (а не только упомянут в D:)
+#   strings           - имена (по возрастанию, id = номер в этом порядке), затем версии
+MAPPED_INDEX_MAGIC = b'KIDX'
+MAPPED_INDEX_VERSION = 1
+MAPPED_INDEX_HEADER = struct.Struct('<4sIIIIII4x')
+
+
+def write_mapped_index(index, path):
+    """Сохраняет индекс (самые новые версии пакетов и граф) в бинарный файл для MappedIndex"""
+    compact = get_full_graph(index)
+    names = sorted(compact.names)
+    ids = {name: i for i, name in enumerate(names)}
+    count = len(names)
+    
+    strings = bytearray()
+    name_offsets = array('I', [0])
+    for name in names:
+        strings += name.encode('utf-8')
+        name_offsets.append(len(strings))
+    
+    version_offsets = array('I', [len(strings)])
+    flags = bytearray(count)
+    for i, name in enumerate(names):
+        versions = index['packages'].get(name)
+        if versions:
+            flags[i] = 1
+            strings += (versions[-1].get('version') or '').encode('utf-8')
+        version_offsets.append(len(strings))
+    
+    offsets = array('I', [0])
+    edges = array('I')
+    for name in names:
+        edges.extend(ids[compact.names[dep]] for dep in compact.dependencies(compact.ids[name]))
+        offsets.append(len(edges))
+    
+    hash_size = 1
+    while hash_size < count * 2:
+        hash_size *= 2
+    table = array('I', bytes(4 * hash_size))
+    for i, name in enumerate(names):
+        slot = zlib.crc32(name.encode('utf-8')) & (hash_size - 1)
+        while table[slot]:
+            slot = (slot + 1) & (hash_size - 1)
+        table[slot] = i + 1
+    
+    parts = [MAPPED_INDEX_HEADER.pack(MAPPED_INDEX_MAGIC, MAPPED_INDEX_VERSION,
+                                      sys.byteorder == 'little', count, len(edges),
+                                      hash_size, len(strings))]
+    for section in (name_offsets, version_offsets, table, offsets, edges):
+        parts.append(section.tobytes())
+    # flags выравниваем до 4 байт, хотя дальше идут только строки
+    parts.append(bytes(flags) + bytes(-count % 4))
+    parts.append(bytes(strings))
+    write_file_atomic(path, b''.join(parts))
+
+
+class MappedIndex:
+    """Бинарный индекс, открытый через mmap: ничего не разбирается заранее
+    
+    Массивы - это memoryview.cast('I') прямо поверх отображённого файла,
+    поэтому открытие занимает микросекунды, а поиск пакета и его замыкание
+    читают с диска только те страницы, которые действительно нужны.
+    get() возвращает PackageRecord с уже разрешёнными зависимостями, так что
+    индекс подходит как get_package_func для build_graph_bfs.
+    """
+    
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < MAPPED_INDEX_HEADER.size:
+                raise ValueError(f"'{path}' - не бинарный индекс (файл слишком короткий)")
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.mmap)
+        magic, version, little, count, edge_count, hash_size, strings_len = \
+            MAPPED_INDEX_HEADER.unpack_from(view)
+        
+        error = None
+        if magic != MAPPED_INDEX_MAGIC or version != MAPPED_INDEX_VERSION:
+            error = f"'{path}' - не бинарный индекс версии {MAPPED_INDEX_VERSION}"
+        elif little != (sys.byteorder == 'little'):
+            error = f"'{path}' записан с другим порядком байт - пересоздайте его"
+        else:
+            expected = (MAPPED_INDEX_HEADER.size + 4 * (3 * (count + 1) + hash_size + edge_count)
+                        + count + (-count % 4) + strings_len)
+            if len(view) < expected:
+                error = f"'{path}' обрезан: {len(view)} байт вместо {expected}"
+        if error:
+            view.release()
+            self.mmap.close()
+            raise ValueError(error)
+        
+        self.count = count
+        self.hash_size = hash_size
+        position = MAPPED_INDEX_HEADER.size
+        sections = []
+        for length in (count + 1, count + 1, hash_size, count + 1, edge_count):
+            sections.append(view[position:position + 4 * length].cast('I'))
+            position += 4 * length
+        self.name_offsets, self.version_offsets, self.table, self.offsets, self.edges = sections
+        self.flags = view[position:position + count]
+        position += count + (-count % 4)
+        self.strings = view[position:position + strings_len]
+        self.view = view
+    
+    def close(self):
+        for section in (self.name_offsets, self.version_offsets, self.table,
+                        self.offsets, self.edges, self.flags, self.strings, self.view):
+            section.release()
+        self.mmap.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def __len__(self):
+        return self.count
+    
+    def find(self, name):
+        """id пакета по имени или None"""
+        key = name.encode('utf-8')
+        mask = self.hash_size - 1
+        slot = zlib.crc32(key) & mask
+        while True:
+            entry = self.table[slot]
+            if not entry:
+                return None
+            i = entry - 1
+            if self.strings[self.name_offsets[i]:self.name_offsets[i + 1]] == key:
+                return i
+            slot = (slot + 1) & mask
+    
+    def name(self, i):
+        return str(self.strings[self.name_offsets[i]:self.name_offsets[i + 1]], 'utf-8')
+    
+    def version(self, i):
+        return str(self.strings[self.version_offsets[i]:self.version_offsets[i + 1]], 'utf-8')
+    
+    def dependencies(self, i):
+        return self.edges[self.offsets[i]:self.offsets[i + 1]]
+    
+    def get(self, name):
+        i = self.find(name)
+        if i is None or not self.flags[i]:
+            return None
+        depends = ' '.join(self.name(dep) for dep in self.dependencies(i))
+        return PackageRecord(name, self.version(i), depends)
+    
+    def closure(self, name):
+        """Все зависимости пакета: {имя: глубина}, None если пакета нет"""
+        start = self.find(name)
+        if start is None:
+            return None
+        depth = {start: 0}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            for dep in self.dependencies(node):
+                if dep not in depth:
+                    depth[dep] = depth[node] + 1
+                    queue.append(dep)
+        del depth[start]
+        return {self.name(node): level for node, level in depth.items()}
+
+
+# ОБРАТНЫЕ ЗАВИСИМОСТИ
+
+def get_full_graph(index):
+    """Граф всех пакетов индекса (строится один раз и хранится в индексе)"""
+    if 'graph' not in index:
+        index['graph'] = build_full_graph(index)
+    return index['graph']
+
+
+def get_reverse_index(index):
+    """Обратный граф: для каждого пакета - кто от него напрямую зависит"""
+    if 'reverse' not in index:
+        index['reverse'] = get_full_graph(index).reverse()
+    return index['reverse']
+
+
+def find_reverse_dependencies(index, package_name):
+    """Все пакеты, которые транзитивно зависят от package_name: {имя: глубина}
+    
+    Глубина 1 - зависят напрямую. Обход идёт по обратному графу,
+    поэтому каждый шаг - срез массива, а не просмотр всех пакетов.
+    """
+    reverse = get_reverse_index(index)
+    if package_name not in reverse.ids:
+        return None
+    
+    start = reverse.ids[package_name]
+    depth = reverse.closure([start])
+    
+    # Сам пакет попадает в результат, только если зависит от себя через цикл
+    in_cycle = any(start in reverse.dependencies(node) for node in depth if node != start) \
+        or start in reverse.dependencies(start)
+    if not in_cycle:
+        del depth[start]
+    
+    names = reverse.names
+    return {names[node]: level for node, level in depth.items()}
+
+
+def reverse_dependency_stats(dependents):
+    """Сводка по результату find_reverse_dependencies"""
+    by_depth = {}
+    for level in dependents.values():
+        by_depth[level] = by_depth.get(level, 0) + 1
+    
+    return {
+        'total': len(dependents),
+        'direct': by_depth.get(1, 0),
+        'max_depth': max(by_depth) if by_depth else 0,
+        'by_depth': dict(sorted(by_depth.items())),
+    }
+
+
+def print_reverse_dependencies(package_name, dependents):
+    
+    print("\n" + "="*50)
+    print(f"КТО ЗАВИСИТ ОТ '{package_name}'")
+    print("="*50)
+    
+    stats = reverse_dependency_stats(dependents)
+    
+    levels = {}
+    for name, level in dependents.items():
+        levels.setdefault(level, []).append(name)
+    
+    for level in sorted(levels):
+        print(f"Глубина {level}: {', '.join(sorted(levels[level]))}")
+    
+    print("\n" + "="*50)
+    print(f"Всего зависимых пакетов: {stats['total']}")
+    print(f"Напрямую: {stats['direct']}")
+    print(f"Максимальная глубина: {stats['max_depth']}")
+    print("="*50 + "\n")
+
+
+def print_graph(graph, cycles):
+    
+    print("\n" + "="*50)
+    print("ГРАФ ЗАВИСИМОСТЕЙ")
+    print("="*50)
+    
+    for package, deps in graph.items():
+        if deps:
+            print(f"{package} -> {', '.join(deps)}")
+        else:
+            print(f"{package} -> (нет зависимостей)")
+    
+    print("\n" + "="*50)
+    print(f"Всего пакетов в графе: {len(graph)}")
+    
+    if cycles:
+        print(f"Найдено циклов: {len(cycles)}")
+        print("\nЦиклические зависимости:")
+        for i, cycle in enumerate(cycles, 1):
+            print(f"  {i}. {' -> '.join(cycle)}")
+    else:
+        print("Циклических зависимостей не обнаружено ")
+    
+    print("="*50 + "\n")
+
+
+# ВЫВОД ГРАФА
+
+class GraphWriter:
+    """Вывод графа по мере обхода: start() -> node() на каждый узел -> finish()
+    
+    Строки копятся в буфере и пишутся в поток пачками, а не print на каждую.
+    """
+    extension = '.txt'
+    buffer_lines = 4096
+    
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = []
+    
+    def write(self, line):
+        self.buffer.append(line)
+        if len(self.buffer) >= self.buffer_lines:
+            self.flush()
+    
+    def flush(self):
+        if self.buffer:
+            self.stream.write('\n'.join(self.buffer) + '\n')
+            self.buffer.clear()
+        self.stream.flush()
+    
+    def start(self, root):
+        pass
+    
+    def node(self, package, pkg_info, dependencies):
+        pass
+    
+    def finish(self, graph, cycles):
+        self.flush()
+
+
+class TextWriter(GraphWriter):
+    """Текст как раньше (print_graph) - целиком после обхода"""
+    
+    def finish(self, graph, cycles):
+        with contextlib.redirect_stdout(self.stream):
+            print_graph(graph, cycles)
+        self.flush()
+
+
+class AdjacencyWriter(GraphWriter):
+    """Список смежности: строка "пакет -> зависимости" на каждый узел"""
+    
+    def node(self, package, pkg_info, dependencies):
+        self.write(f"{package} -> {' '.join(dependencies)}" if dependencies else package)
+
+
+class JsonLinesWriter(GraphWriter):
+    """JSON Lines: узел, затем его рёбра; в конце - найденные циклы"""
+    extension = '.jsonl'
+    
+    def node(self, package, pkg_info, dependencies):
+        if pkg_info is None:
+            self.write(json.dumps({'package': package, 'missing': True}, ensure_ascii=False))
+            return
+        self.write(json.dumps({'package': package, 'version': pkg_info.get('version')}, ensure_ascii=False))
+        for dep in dependencies:
+            self.write(json.dumps({'from': package, 'to': dep}, ensure_ascii=False))
+    
+    def finish(self, graph, cycles):
+        for cycle in cycles:
+            self.write(json.dumps({'cycle': cycle}, ensure_ascii=False))
+        self.flush()
+
+
+class DotWriter(GraphWriter):
+    """Graphviz DOT; пакеты из циклов выделяются красным"""
+    extension = '.dot'
+    
+    @staticmethod
+    def quote(name):
+        return '"' + name.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    
+    def start(self, root):
+        self.write('digraph dependencies {')
+        self.write(f'  {self.quote(root)} [shape=box];')
+    
+    def node(self, package, pkg_info, dependencies):
+        source = self.quote(package)
+        if pkg_info is None:
+            self.write(f'  {source} [style=dashed];')
+        elif not dependencies:
+            self.write(f'  {source};')
+        for dep in dependencies:
+            self.write(f'  {source} -> {self.quote(dep)};')
+    
+    def finish(self, graph, cycles):
+        for cycle in cycles:
+            for package in dict.fromkeys(cycle):
+                self.write(f'  {self.quote(package)} [color=red];')
+        self.write('}')
+        self.flush()
+
+
+class CsvWriter(GraphWriter):
+    """CSV: package,version,depends (зависимости через пробел)"""
+    extension = '.csv'
+    
+    def __init__(self, stream):
+        super().__init__(stream)
+        self.row = io.StringIO()
+        self.csv = csv.writer(self.row, lineterminator='')
+    
+    def start(self, root):
+        self.write('package,version,depends')
+    
+    def node(self, package, pkg_info, dependencies):
+        version = pkg_info.get('version') if pkg_info is not None else ''
+        self.csv.writerow([package, version or '', ' '.join(dependencies)])
+        self.write(self.row.getvalue())
+        self.row.seek(0)
+        self.row.truncate()
+
+
+def render_ascii_tree(graph, root, max_depth=None):
+    """Дерево зависимостей псевдографикой ASCII, по строке за раз (генератор)
+    
+    Общие поддеревья раскрываются один раз: пакет, на который ссылаются
+    несколько других, получает метку [n], а дальше выводится как "имя -> [n]".
+    Поэтому строк не больше, чем рёбер + 1, а не экспоненциально много.
+    Пакет, уже лежащий на текущем пути, помечается "(цикл)". Глубже max_depth
+    не раскрываем - такой пакет выводится с "...".
+    """
+    indegree = {}
+    for deps in graph.values():
+        for dep in deps:
+            indegree[dep] = indegree.get(dep, 0) + 1
+    
+    labels = {}
+    
+    def title(name):
+        if indegree.get(name, 0) > 1:
+            labels[name] = len(labels) + 1
+            return f"{name} [{labels[name]}]"
+        return name
+    
+    root_deps = graph.get(root) or ()
+    if root_deps and max_depth == 0:
+        yield f"{root} ..."
+        return
+    yield title(root)
+    
+    # Явный стек вместо рекурсии: [пакет, зависимости, следующий индекс, отступ]
+    on_path = {root}
+    stack = [[root, root_deps, 0, '']]
+    while stack:
+        frame = stack[-1]
+        package, deps, i, prefix = frame
+        if i == len(deps):
+            stack.pop()
+            on_path.discard(package)
+            continue
+        frame[2] = i + 1
+        
+        dep = deps[i]
+        last = i == len(deps) - 1
+        line = prefix + ('`-- ' if last else '|-- ') + dep
+        dep_deps = graph.get(dep) or ()
+        
+        if dep in on_path:
+            yield line + " (цикл)"
+        elif dep in labels:
+            yield f"{line} -> [{labels[dep]}]"
+        elif not dep_deps:
+            yield line
+        elif max_depth is not None and len(stack) >= max_depth:
+            yield line + " ..."
+        else:
+            yield prefix + ('`-- ' if last else '|-- ') + title(dep)
+            on_path.add(dep)
+            stack.append([dep, dep_deps, 0, prefix + ('    ' if last else '|   ')])
+
+
+class TreeWriter(GraphWriter):
+    """ASCII-дерево (render_ascii_tree) - после обхода, когда граф известен целиком"""
+    
+    def __init__(self, stream, max_depth=None):
+        super().__init__(stream)
+        self.max_depth = max_depth
+        self.root = None
+    
+    def start(self, root):
+        self.root = root
+    
+    def finish(self, graph, cycles):
+        for line in render_ascii_tree(graph, self.root, self.max_depth):
+            self.write(line)
+        self.flush()
+
+
+class PlanWriter(GraphWriter):
+    """Порядок установки, волны и самая длинная цепочка (install_plan)"""
+    
+    def start(self, root):
+        self.root = root
+    
+    def finish(self, graph, cycles):
+        plan = install_plan(graph)
+        in_cycle = {name for cycle in plan['cycles'] for name in cycle}
+        
+        self.write(f"Порядок установки ({len(plan['order'])} пакетов):")
+        for i, name in enumerate(plan['order'], 1):
+            self.write(f"  {i}. {name}" + (" (цикл)" if name in in_cycle else ""))
+        
+        self.write("")
+        self.write(f"Волны установки ({len(plan['waves'])}), пакеты одной волны ставятся параллельно:")
+        for i, wave in enumerate(plan['waves'], 1):
+            self.write(f"  {i}: {' '.join(wave)}")
+        
+        path = critical_path(plan, self.root)
+        self.write("")
+        self.write(f"Самая длинная цепочка (длина {len(path) - 1}): {' -> '.join(path)}")
+        self.flush()
+
+
+# ascii - то же дерево, что выбирает ascii_output=true
+GRAPH_WRITERS = {
+    'text': TextWriter,
+    'tree': TreeWriter,
+    'ascii': TreeWriter,
+    'plan': PlanWriter,
+    'adjacency': AdjacencyWriter,
+    'jsonl': JsonLinesWriter,
+    'dot': DotWriter,
+    'csv': CsvWriter,
+}
+
+
+def output_format(config):
+    """output_format из конфига; без него ascii_output=true выбирает дерево"""
+    if config.get('output_format'):
+        return config['output_format']
+    if config.get('ascii_output', 'false').lower() == 'true':
+        return 'tree'
+    return 'text'
+
+
+def make_graph_writer(config, stream):
+    writer_class = GRAPH_WRITERS[output_format(config)]
+    if writer_class is TreeWriter:
+        max_depth = int(config['max_depth']) if config.get('max_depth') else None
+        return TreeWriter(stream, max_depth)
+    return writer_class(stream)
+
+
+def log_to_stderr(config):
+    """При машиночитаемом выводе сообщения программы уходят в stderr"""
+    if output_format(config) == 'text':
+        return contextlib.nullcontext()
+    return contextlib.redirect_stdout(sys.stderr)
+
+
+#  ЗАГРУЗКА РЕПОЗИТОРИЯ
+
+def load_repository_index(config):
+    """Загружает репозиторий любого типа и разбирает его в индекс пакетов (один раз)"""
+    
+    repository_url = config['repository_url']
+    repo_mode = config['repo_mode']
+    lazy = config.get('lazy_index', 'false').lower() == 'true'
+    
+    # Определяем тип репозитория
+    repo_type = check_repo_type(repository_url, repo_mode)
+    print(f"Тип репозитория: {repo_type}\n")
+    
+    #  ТЕСТОВЫЙ РЕЖИМ 
+    if repo_type == 'test':
+        print(" ТЕСТОВЫЙ РЕЖИМ \n")
+        
+        test_packages = read_test_repo(repository_url)
+        if not test_packages:
+            return None
+        
+        return build_package_index(test_packages.values())
+    
+    #  HTTP РЕПОЗИТОРИЙ 
+    elif repo_type == 'http':
+        print(" HTTP РЕПОЗИТОРИЙ \n")
+        
+        # В repository_url можно перечислить несколько репозиториев через пробел,
+        # в arch - несколько архитектур (например: x86_64 aarch64)
+        repository_urls = repository_url.split()
+        arches = config.get('arch', '').split() or ['x86_64']
+        return fetch_indexes(repository_urls, arches, lazy=lazy)
+    
+    #  GIT РЕПОЗИТОРИЙ 
+    elif repo_type == 'git':
+        print(" GIT РЕПОЗИТОРИЙ \n")
+        # Рабочая копия живёт в кэше и переиспользуется между запусками
+        repo_dir = clone_git_repo(repository_url)
+        if not repo_dir:
+            return None
+        
+        # Для этого коммита индекс уже собирали из .apk - сканировать не нужно
+        synthetic_path = synthetic_apkindex_path(repository_url, get_git_head(repo_dir))
+        if synthetic_path and os.path.exists(synthetic_path):
+            print(f"Используем собранный ранее APKINDEX: {synthetic_path}\n")
+            return read_apkindex_from_file(synthetic_path, lazy)
+        
+        # Ищем APKINDEX и .apk за один обход
+        found_files = scan_repository_tree(repo_dir)
+        apkindex_files = found_files['apkindex']
+        
+        if apkindex_files:
+            print(f"Найден APKINDEX: {apkindex_files[0]}\n")
+            return read_apkindex_from_file(apkindex_files[0], lazy)
+        
+        print("APKINDEX не найден — ищем .apk файлы...\n")
+        apk_files = found_files['apk']
+        if not apk_files:
+            print(".apk файлы не найдены, нечего анализировать.")
+            return None
+
+        print(f"Найдено .apk файлов: {len(apk_files)}\n")
+        
+        # Собираем пакеты
+        all_packages = {}
+        for info in read_apk_files(apk_files):
+            if info and info['name']:
+                all_packages[info['name']] = info
+        
+        if not all_packages:
+            print("⚠️ Не удалось извлечь информацию из .apk файлов.")
+            return None
+        
+        print(f" Собрано {len(all_packages)} пакетов из .apk\n")
+        
+        # Сохраняем как обычный APKINDEX - следующий запуск на том же коммите
+        # пойдёт через быстрый загрузчик индекса
+        if synthetic_path:
+            try:
+                write_file_atomic(synthetic_path, format_apkindex(all_packages.values()).encode('utf-8'))
+            except OSError as e:
+                print(f"Не удалось сохранить APKINDEX: {e}")
+        
+        return build_package_index(all_packages.values())
+                
+    else:
+        print("ОШИБКА: Неизвестный тип репозитория")
+        return None
+
+
+#  ГЛАВНАЯ ФУНКЦИЯ 
+
+def make_package_lookups(index, package_name, package_version=''):
+    """Функции get_package и resolve для build_graph_bfs по загруженному индексу"""
+    
+    # Версия, выбранная для пакета первым ограничением, которое на него сослалось
+    chosen = {}
+    
+    # so:/cmd:/pc: и другие provides превращаются в имя настоящего пакета
+    def resolve(token):
+        name, op, version, conflict = parse_dependency(token)
+        if conflict:
+            return None
+        count_stat('индекс: зависимостей')
+        pkg_info = resolve_dependency(index, token)
+        if pkg_info is None:
+            if name in index['packages']:
+                print(f"ВНИМАНИЕ: Ограничение '{token}' не выполняется, берём самую новую версию")
+            return name
+        chosen.setdefault(pkg_info['name'], pkg_info)
+        return pkg_info['name']
+    
+    # Поиск пакета в индексе - O(1) на каждый узел графа
+    def get_package(pkg_name):
+        count_stat('индекс: пакетов')
+        if pkg_name in chosen:
+            return chosen[pkg_name]
+        if pkg_name == package_name:
+            return find_package_in_index(index, pkg_name, package_version)
+        return find_package_in_index(index, pkg_name, '')
+    
+    return get_package, resolve
+
+
+def build_dependency_graph(config, index=None):
+    """Главная функция - строит граф зависимостей
+    
+    index можно передать уже загруженный, чтобы не разбирать репозиторий заново
+    для каждого стартового пакета.
+    """
+    
+    package_name = config['package_name']
+    package_version = config.get('package_version', '')
+    repository_url = config['repository_url']
+    repo_mode = config['repo_mode']
+    
+    if output_format(config) == 'text':
+        print(f"Пакет: {package_name}")
+        if package_version:
+            print(f"Версия: {package_version}")
+        print(f"Репозиторий: {repository_url}")
+        print(f"Режим: {repo_mode}\n")
+    
+    if index is None:
+        index = load_repository_index(config)
+        if not index:
+            return None
+    
+    # '*' - анализ всего репозитория целиком
+    if package_name == '*':
+        analyze_whole_repository(index)
+        return index
+    
+    # Сравнение с предыдущим снимком репозитория
+    if config.get('query') == 'diff':
+        run_snapshot_diff(config, index)
+        return index
+    
+    # Обратный запрос: кто зависит от пакета
+    if config.get('query') == 'rdeps':
+        dependents = find_reverse_dependencies(index, package_name)
+        if dependents is None:
+            print(f"Пакет '{package_name}' не найден в репозитории")
+        else:
+            print_reverse_dependencies(package_name, dependents)
+        return index
+    
+    get_package, resolve = make_package_lookups(index, package_name, package_version)
+    
+    quiet = config.get('quiet', 'false').lower() == 'true'
+    writer = make_graph_writer(config, sys.stdout)
+    
+    # Машиночитаемый вывод идёт в stdout один, сообщения - в stderr
+    with log_to_stderr(config):
+        writer.start(package_name)
+        graph, visited, cycles = build_graph_bfs(package_name, get_package, resolve,
+                                                 on_node=writer.node, quiet=quiet)
+        writer.finish(graph, cycles)
+    return index
+
+
+# СЕРВЕР
+
+class ResolverService:
+    """Загруженные индексы и кэш ответов для режима сервера
+    
+    Индексы живут в памяти всё время работы и обновляются в фоне; ответы
+    на запросы (замыкания, обратные зависимости, циклы) хранятся в LRU
+    на cache_size записей, самые давно не нужные вытесняются.
+    """
+    
+    def __init__(self, configs, cache_size=1024):
+        self.configs = configs
+        self.indexes = {}
+        # Номер версии индекса: растёт при каждой подмене, входит в ключи кэша
+        self.generations = {}
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+    
+    def load(self):
+        for config in self.configs:
+            key = repository_key(config)
+            if key not in self.indexes:
+                index = load_repository_index(config)
+                if not index:
+                    print(f"ОШИБКА: Репозиторий {config['repository_url']} не загружен")
+                    sys.exit(1)
+                self.indexes[key] = index
+                self.generations[key] = 0
+    
+    def refresh(self):
+        """Перечитывает индексы; если репозиторий изменился - подменяет его и чистит кэш"""
+        for config in self.configs:
+            key = repository_key(config)
+            try:
+                index = load_repository_index(config)
+            except Exception as e:
+                print(f"ОШИБКА обновления {config['repository_url']}: {e}")
+                continue
+            # 304 от зеркала: загрузчик вернул тот же индекс - сравнивать нечего
+            if not index or index is self.indexes[key]:
+                continue
+            diff = diff_indexes(self.indexes[key], index)
+            # В тестовом режиме версии всегда 1.0 - меняются только зависимости
+            if not (diff['added'] or diff['removed'] or diff['updated'] or diff['edges']):
+                continue
+            with self.lock:
+                self.indexes[key] = index
+                self.generations[key] += 1
+                for cache_key in [k for k in self.cache if k[0][0] == key]:
+                    del self.cache[cache_key]
+            print(f"Обновлён {config['repository_url']}: +{len(diff['added'])} "
+                  f"-{len(diff['removed'])} ~{len(diff['updated'])}, рёбра: {len(diff['edges'])}")
+    
+    def refresh_forever(self, interval):
+        while not self.stop.wait(interval):
+            self.refresh()
+    
+    def repository(self, repo):
+        """Конфиг по номеру (с 0) или repository_url; по умолчанию - первый"""
+        if not repo:
+            return self.configs[0]
+        if repo.isdigit() and int(repo) < len(self.configs):
+            return self.configs[int(repo)]
+        for config in self.configs:
+            if config['repository_url'] == repo:
+                return config
+        return None
+    
+    def cached(self, key, compute):
+        """Ответ из LRU или compute(); key[0] - (репозиторий, номер версии индекса)"""
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        value = compute()
+        with self.lock:
+            # Пока считали, индекс подменили - ответ устарел, в кэш его не кладём
+            repo, generation = key[0]
+            if self.generations[repo] != generation:
+                return value
+            self.cache[key] = value
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return value
+    
+    def query(self, kind, package_name, package_version='', repo=''):
+        config = self.repository(repo)
+        if config is None:
+            return 404, {'error': f"нет репозитория '{repo}'"}
+        with self.lock:
+            repo = repository_key(config)
+            index = self.indexes[repo]
+            key = (repo, self.generations[repo])
+        
+        if kind == 'cycles' and not package_name:
+            return 200, self.cached((key, kind), lambda: {'cycles': repository_cycles(index)})
+        if not package_name:
+            return 400, {'error': "нужен параметр package"}
+        if package_name not in index['packages']:
+            return 404, {'error': f"пакет '{package_name}' не найден"}
+        
+        def deps():
+            get_package, resolve = make_package_lookups(index, package_name, package_version)
+            graph, _, cycles = build_graph_bfs(package_name, get_package, resolve, quiet=True)
+            return {'package': package_name, 'count': len(graph) - 1,
+                    'graph': graph, 'cycles': cycles}
+        
+        if kind == 'deps':
+            return 200, self.cached((key, kind, package_name, package_version), deps)
+        if kind == 'cycles':
+            result = self.cached((key, 'deps', package_name, package_version), deps)
+            return 200, {'package': package_name, 'cycles': result['cycles']}
+        if kind == 'order':
+            def order():
+                plan = install_plan(self.cached((key, 'deps', package_name, package_version), deps)['graph'])
+                result = {key: plan[key] for key in ('order', 'waves', 'depth', 'cycles')}
+                result['critical_path'] = critical_path(plan, package_name)
+                return result
+            return 200, self.cached((key, kind, package_name, package_version), order)
+        if kind == 'rdeps':
+            return 200, self.cached((key, kind, package_name), lambda: {
+                'package': package_name,
+                'dependents': find_reverse_dependencies(index, package_name),
+            })
+        return 404, {'error': f"неизвестный запрос '{kind}'"}
+
+
+def repository_cycles(index):
+    """Циклы во всём репозитории - по одному на компоненту сильной связности"""
+    return find_cycles(get_full_graph(index).to_dict())
+
+
+class QueryHandler(http.server.BaseHTTPRequestHandler):
+    """GET /deps, /rdeps, /cycles, /order ?package=...&version=...&repo=...; /status"""
+    service = None
+    
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        kind = url.path.strip('/')
+        
+        if kind == 'status':
+            status, body = 200, {
+                'repositories': [config['repository_url'] for config in self.service.configs],
+                'packages': [len(index['packages']) for index in self.service.indexes.values()],
+                'cached': len(self.service.cache),
+            }
+        else:
+            status, body = self.service.query(kind, params.get('package', ''),
+                                              params.get('version', ''), params.get('repo', ''))
+        
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def log_message(self, format, *args):
+        pass
+
+
+def run_server(configs, port=8377, refresh=300, cache_size=1024):
+    """Сервер на localhost: индексы загружаются один раз и держатся в памяти"""
+    service = ResolverService(configs, cache_size)
+    service.load()
+    
+    if refresh > 0:
+        threading.Thread(target=service.refresh_forever, args=(refresh,), daemon=True).start()
+    
+    handler = type('Handler', (QueryHandler,), {'service': service})
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), handler)
+    print(f"Сервер запущен: http://127.0.0.1:{server.server_address[1]}/deps?package=<имя>")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nОстанавливаем сервер")
+    finally:
+        service.stop.set()
+        server.server_close()
+
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
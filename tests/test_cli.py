@@ -0,0 +1,46 @@
+"""Пакеты из командной строки (-p, --packages-file): имя и ограничение версии."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+
+
+@pytest.mark.parametrize('package, name, version', [
+    ('curl', 'curl', ''),
+    ('curl>=8.0', 'curl', '>=8.0'),
+    ('curl=8.5.0-r0', 'curl', '=8.5.0-r0'),
+    ('curl~8.5', 'curl', '~8.5'),
+    ('*', '*', ''),
+])
+def test_package_config(package, name, version):
+    config = main.package_config({'repo_mode': 'test'}, package)
+    assert (config['package_name'], config['package_version']) == (name, version)
+    assert config['repo_mode'] == 'test'
+
+
+def test_conflict_is_rejected(capsys):
+    with pytest.raises(SystemExit):
+        main.package_config({}, '!curl')
+    assert "'!curl'" in capsys.readouterr().err
+
+
+def test_conflict_rejected_before_loading(tmp_path, capsys, monkeypatch):
+    loads = []
+    monkeypatch.setattr(main, 'load_repository_index', lambda config: loads.append(config))
+    config = tmp_path / 'config.csv'
+    config.write_text("param,value\npackage_name,A\nrepository_url,repo.txt\nrepo_mode,test\n",
+                      encoding='utf-8')
+    with pytest.raises(SystemExit):
+        main.main([str(config), '-p', 'A', '-p', '!B'])
+    assert loads == []
+
+
+def test_ascii_format_is_the_tree():
+    assert main.output_format({'ascii_output': 'true'}) == 'tree'
+    tree = main.make_graph_writer({'ascii_output': 'true'}, sys.stdout)
+    ascii_format = main.make_graph_writer({'output_format': 'ascii'}, sys.stdout)
+    assert type(tree) is type(ascii_format) is main.TreeWriter
+    assert type(main.make_graph_writer({'output_format': 'adjacency'}, sys.stdout)) is main.AdjacencyWriter
@@ -0,0 +1,77 @@
+"""Кэш git-клонов: первый клон со sparse checkout, повторный запуск без изменений
+и обновление, когда в репозитории появился новый коммит.
+
+Вместо удалённого сервера - временный bare-репозиторий (file://).
+"""
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+
+
+pytestmark = pytest.mark.skipif(shutil.which('git') is None, reason="git не установлен")
+
+
+def git(*args):
+    result = subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', *args],
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    return result.stdout.strip()
+
+
+def commit_files(work, files, message):
+    for name, text in files.items():
+        path = os.path.join(work, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+    git('-C', work, 'add', '-A')
+    git('-C', work, 'commit', '-q', '-m', message)
+    git('-C', work, 'push', '-q', 'origin', 'HEAD')
+    return git('-C', work, 'rev-parse', 'HEAD')
+
+
+@pytest.fixture
+def bare_repo(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'CACHE_DIR', str(tmp_path / 'cache'))
+    bare = tmp_path / 'repo.git'
+    work = tmp_path / 'work'
+    git('init', '-q', '--bare', str(bare))
+    git('clone', '-q', str(bare), str(work))
+    first = commit_files(str(work), {
+        'main/x86_64/APKINDEX': 'P:musl\nV:1.0\n',
+        'main/x86_64/musl-1.0.apk': 'apk',
+        'README.md': 'не нужен анализатору',
+        'src/build.sh': 'echo',
+    }, 'first')
+    return f"file://{bare}", str(work), first
+
+
+def test_sparse_clone_then_reuse_then_update(bare_repo, capsys):
+    url, work, first = bare_repo
+
+    repo_dir = main.clone_git_repo(url)
+    assert repo_dir is not None
+    assert main.get_git_head(repo_dir) == first
+    # sparse checkout: только APKINDEX и .apk
+    assert os.path.exists(os.path.join(repo_dir, 'main', 'x86_64', 'APKINDEX'))
+    assert os.path.exists(os.path.join(repo_dir, 'main', 'x86_64', 'musl-1.0.apk'))
+    assert not os.path.exists(os.path.join(repo_dir, 'README.md'))
+    assert not os.path.exists(os.path.join(repo_dir, 'src'))
+
+    capsys.readouterr()
+    assert main.clone_git_repo(url) == repo_dir
+    assert "Не изменился" in capsys.readouterr().out
+
+    second = commit_files(work, {'main/x86_64/APKINDEX': 'P:musl\nV:1.1\n'}, 'second')
+    assert main.clone_git_repo(url) == repo_dir
+    assert "Обновлено" in capsys.readouterr().out
+    assert main.get_git_head(repo_dir) == second
+    with open(os.path.join(repo_dir, 'main', 'x86_64', 'APKINDEX'), encoding='utf-8') as f:
+        assert 'V:1.1' in f.read()
+    assert not os.path.exists(os.path.join(repo_dir, 'README.md'))
@@ -0,0 +1,169 @@
+"""Кэш HTTP-индексов: ETag/Last-Modified, ответ 304, устаревший кэш и ротация снимков.
+
+Вместо настоящего зеркала Alpine - локальный http.server.
+"""
+import functools
+import gzip
+import http.server
+import io
+import os
+import sys
+import tarfile
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+
+
+APKINDEX_V1 = """P:musl
+V:1.2.4-r2
+
+P:curl
+V:8.0-r0
+D:musl
+"""
+
+APKINDEX_V2 = APKINDEX_V1.replace('8.0-r0', '8.1-r0')
+
+
+def write_apkindex(path, text, mtime):
+    data = text.encode()
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        info = tarfile.TarInfo('APKINDEX')
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    with open(path, 'wb') as f:
+        f.write(gzip.compress(buffer.getvalue()))
+    os.utime(path, (mtime, mtime))
+
+
+class Server:
+    """http.server в отдельном потоке; statuses - коды всех ответов, clients - адреса клиентов"""
+
+    def __init__(self, directory):
+        self.statuses = []
+        self.clients = []
+        statuses = self.statuses
+        clients = self.clients
+
+        class Handler(http.server.SimpleHTTPRequestHandler):
+            # Keep-alive, как у настоящих зеркал
+            protocol_version = 'HTTP/1.1'
+
+            def send_response(self, code, message=None):
+                statuses.append(code)
+                clients.append(self.client_address)
+                super().send_response(code, message)
+
+            def log_message(self, format, *args):
+                pass
+
+        handler = functools.partial(Handler, directory=directory)
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def repository(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'CACHE_DIR', str(tmp_path / 'cache'))
+    root = tmp_path / 'www'
+    (root / 'x86_64').mkdir(parents=True)
+    path = root / 'x86_64' / 'APKINDEX.tar.gz'
+    write_apkindex(path, APKINDEX_V1, 1_700_000_000)
+    server = Server(str(root))
+    yield server, path
+    server.stop()
+
+
+def count_parses(monkeypatch):
+    calls = []
+    original = main.build_package_index
+
+    def counted(records):
+        calls.append(1)
+        return original(records)
+
+    monkeypatch.setattr(main, 'build_package_index', counted)
+    return calls
+
+
+def test_second_run_gets_304_and_skips_parsing(repository, monkeypatch):
+    server, _ = repository
+    first = main.download_apkindex_http(server.url)
+    assert first['packages']['curl'][-1]['version'] == '8.0-r0'
+    assert server.statuses == [200]
+
+    parses = count_parses(monkeypatch)
+    second = main.download_apkindex_http(server.url)
+    assert server.statuses == [200, 304]
+    assert parses == []
+    assert second['packages']['curl'][-1]['version'] == '8.0-r0'
+
+
+def test_changed_index_rotates_snapshot(repository):
+    server, path = repository
+    main.download_apkindex_http(server.url)
+    write_apkindex(path, APKINDEX_V2, 1_700_000_100)
+
+    index = main.download_apkindex_http(server.url)
+    assert server.statuses == [200, 200]
+    assert index['packages']['curl'][-1]['version'] == '8.1-r0'
+
+    cache_dir = main.index_cache_dir(server.url, 'x86_64')
+    previous = main.load_cached_index(cache_dir, 'index.prev.pickle')
+    assert previous['packages']['curl'][-1]['version'] == '8.0-r0'
+
+
+def test_stale_cache_when_server_is_gone(repository):
+    server, _ = repository
+    main.download_apkindex_http(server.url)
+    server.stop()
+
+    index = main.download_apkindex_http(server.url)
+    assert index is not None
+    assert index['packages']['curl'][-1]['version'] == '8.0-r0'
+
+
+def test_connections_are_reused_across_fetches(repository):
+    server, path = repository
+    (path.parent.parent / 'aarch64').mkdir()
+    write_apkindex(path.parent.parent / 'aarch64' / 'APKINDEX.tar.gz', APKINDEX_V1, 1_700_000_000)
+
+    # Каждый вызов fetch_indexes создаёт свой пул потоков, а соединения
+    # всё равно берутся из общего пула
+    for _ in range(3):
+        index = main.fetch_indexes([server.url], ('x86_64', 'aarch64'))
+        assert index['packages']['curl'][-1]['version'] == '8.0-r0'
+
+    assert server.statuses == [200, 200, 304, 304, 304, 304]
+    assert len(set(server.clients)) <= 2
+
+
+def test_lazy_download_skips_full_parse(repository, monkeypatch):
+    server, path = repository
+    parses = count_parses(monkeypatch)
+
+    first = main.download_apkindex_http(server.url, lazy=True)
+    assert isinstance(first['packages'], main.LazyRecords)
+    assert first['packages']['curl'][-1]['version'] == '8.0-r0'
+
+    # Изменился - снова 200 и снова без полного разбора
+    write_apkindex(path, APKINDEX_V2, 1_700_000_100)
+    second = main.download_apkindex_http(server.url, lazy=True)
+    assert second['packages']['curl'][-1]['version'] == '8.1-r0'
+    assert server.statuses == [200, 200]
+    assert parses == []
+
+    # Обычный запуск после ленивого: разобранного индекса в кэше нет - скачиваем заново
+    index = main.download_apkindex_http(server.url)
+    assert server.statuses == [200, 200, 304, 200]
+    assert index['packages']['curl'][-1]['version'] == '8.1-r0'
+    assert parses == [1]
@@ -0,0 +1,98 @@
+"""Инкрементальный пересчёт замыканий (update_closures) против полного пересчёта.
+
+Случайный репозиторий несколько раз подряд случайно меняется: пакеты
+добавляются и удаляются, у пакетов меняются зависимости и появляются циклы.
+После каждого шага замыкания, глубина и признак цикла каждого пакета
+должны совпадать с compute_all_closures по новому снимку.
+"""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+
+
+def make_index(graph):
+    return main.build_package_index(
+        main.PackageRecord(name, '1.0-r0', ' '.join(deps)) for name, deps in graph.items()
+    )
+
+
+def random_graph(rng, count):
+    names = [f"pkg{i}" for i in range(count)]
+    # Зависимости в основном "вниз" по номерам, изредка - обратно (циклы)
+    return {
+        name: sorted({rng.choice(names[i + 1:] if i + 1 < count and rng.random() > 0.05 else names)
+                      for _ in range(rng.randint(0, 3))} - {name})
+        for i, name in enumerate(names)
+    }
+
+
+def mutate(rng, graph, next_id):
+    graph = {name: list(deps) for name, deps in graph.items()}
+    names = list(graph)
+    for _ in range(rng.randint(1, 6)):
+        action = rng.random()
+        if action < 0.2:
+            name = f"pkg{next_id}"
+            next_id += 1
+            graph[name] = rng.sample(names, min(len(names), rng.randint(0, 3)))
+            # На новый пакет иногда кто-то начинает ссылаться
+            if rng.random() < 0.5:
+                graph[rng.choice(names)].append(name)
+        elif action < 0.35 and len(graph) > 5:
+            # Удалённый пакет может остаться в чужих зависимостях - неразрешимым листом
+            del graph[rng.choice(list(graph))]
+        elif action < 0.75:
+            name = rng.choice(list(graph))
+            graph[name] = rng.sample(list(graph), min(len(graph), rng.randint(0, 4)))
+        else:
+            # Обратное ребро - почти наверняка новый цикл
+            a, b = rng.sample(list(graph), 2)
+            graph[a].append(b)
+            graph[b].append(a)
+        names = list(graph)
+    for name, deps in graph.items():
+        graph[name] = [dep for dep in dict.fromkeys(deps) if dep != name]
+    return graph, next_id
+
+
+def summary(closures):
+    compact = closures['graph']
+    return {
+        name: (sorted(main.get_closure(closures, name)),
+               main.closure_depth(closures, name),
+               closures['cyclic'][compact.ids[name]])
+        for name in compact.names
+    }
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_incremental_matches_full_recompute(seed):
+    rng = random.Random(seed)
+    graph = random_graph(rng, 60)
+    next_id = len(graph)
+    index = make_index(graph)
+    closures = main.compute_all_closures(main.build_full_graph(index))
+
+    for _ in range(6):
+        graph, next_id = mutate(rng, graph, next_id)
+        new_index = make_index(graph)
+
+        diff = main.diff_indexes(index, new_index)
+        changed = set(diff['edges']) | set(diff['added']) | set(diff['removed'])
+        closures, recomputed = main.update_closures(closures, new_index, changed)
+
+        expected = summary(main.compute_all_closures(main.build_full_graph(new_index)))
+        actual = summary(closures)
+        for name, values in expected.items():
+            assert actual[name] == values, name
+        # Удалённые пакеты, на которые больше никто не ссылается, - просто лишние листья
+        for name in set(actual) - set(expected):
+            assert actual[name][0] == []
+
+        assert changed <= recomputed
+        index = new_index
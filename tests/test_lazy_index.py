@@ -0,0 +1,83 @@
+"""Ленивый APKINDEX: таблица смещений, provides и слияние с обычным индексом.
+
+Ленивый индекс должен отвечать так же, как parse_apkindex по тому же тексту.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+
+
+# P: в первой строке, поля перед P: (C:), пакет в двух версиях,
+# последний блок без пустой строки и перевода строки в конце
+APKINDEX = """P:musl
+V:1.2.4-r2
+p:so:libc.musl-x86_64.so.1=1
+
+C:Q1abc=
+P:busybox
+V:1.36-r0
+D:so:libc.musl-x86_64.so.1
+p:cmd:sh=1.36 /bin/sh
+
+P:busybox
+V:1.37-r0
+D:musl
+
+C:Q1def=
+P:curl
+V:8.10-r0
+D:busybox cmd:sh"""
+
+
+def records(values):
+    return [(pkg['name'], pkg['version'], pkg['depends'], pkg['provides']) for pkg in values]
+
+
+def same_index(expected, actual):
+    for field in ('packages', 'provides'):
+        assert sorted(actual[field]) == sorted(expected[field])
+        assert len(actual[field]) == len(expected[field])
+        for name in expected[field]:
+            assert records(actual[field][name]) == records(expected[field][name]), (field, name)
+
+
+def test_lazy_matches_full_parse():
+    lazy = main.load_apkindex_lazy(APKINDEX.encode())
+    assert isinstance(lazy['packages'], main.LazyRecords)
+    same_index(main.parse_apkindex(APKINDEX), lazy)
+
+
+def test_first_and_last_block():
+    lazy = main.load_apkindex_lazy(APKINDEX.encode())
+    assert records(lazy['packages']['musl']) == [('musl', '1.2.4-r2', '', 'so:libc.musl-x86_64.so.1=1')]
+    assert records(lazy['packages']['curl']) == [('curl', '8.10-r0', 'busybox cmd:sh', '')]
+    # Разобраны только запрошенные блоки
+    assert len(lazy['packages'].records) == 2
+
+
+def test_versions_sorted_and_records_shared():
+    lazy = main.load_apkindex_lazy(APKINDEX.encode())
+    assert [pkg['version'] for pkg in lazy['packages']['busybox']] == ['1.36-r0', '1.37-r0']
+    # Один блок - один объект, через какое бы имя его ни нашли
+    assert lazy['provides']['/bin/sh'][0] is lazy['packages']['busybox'][0]
+    assert 'cmd:sh' in lazy['provides']
+    assert 'so:nothing' not in lazy['provides']
+    with pytest.raises(KeyError):
+        lazy['packages']['nothing']
+
+
+def test_merged_lazy_and_eager():
+    testing = "P:busybox\nV:1.37-r0\nD:zlib\n\nP:zlib\nV:1.3-r0\np:so:libz.so.1=1.3\n"
+    expected = main.merge_indexes([main.parse_apkindex(APKINDEX), main.parse_apkindex(testing)])
+    merged = main.merge_indexes([main.load_apkindex_lazy(APKINDEX.encode()), main.parse_apkindex(testing)])
+    assert isinstance(merged['packages'], main.MergedRecords)
+    same_index(expected, merged)
+    # При равных версиях выигрывает первый репозиторий (он последний в списке)
+    assert merged['packages']['busybox'][-1]['depends'] == 'musl'
+
+    graph, _, _ = main.build_graph_bfs('curl', *main.make_package_lookups(merged, 'curl'), quiet=True)
+    assert graph == {'curl': ['busybox'], 'busybox': ['musl'], 'musl': []}
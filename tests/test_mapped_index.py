@@ -0,0 +1,96 @@
+"""Бинарный индекс: write_mapped_index -> MappedIndex и обратно к тем же ответам.
+
+Проверяются хеш-таблица имён, таблица строк, граф (CSR) и отказ открывать
+пустые и обрезанные файлы.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+
+
+APKINDEX = """P:musl
+V:1.2.4-r2
+p:so:libc.musl-x86_64.so.1=1
+
+P:busybox
+V:1.36-r0
+D:so:libc.musl-x86_64.so.1
+
+P:busybox
+V:1.37-r0
+D:so:libc.musl-x86_64.so.1 musl
+
+P:curl
+V:8.10-r0
+D:busybox libcurl so:libmissing.so.1
+
+P:libcurl
+V:8.10-r0
+D:musl curl
+
+P:пакет
+V:1.0-r0
+D:musl
+"""
+
+
+@pytest.fixture
+def index():
+    return main.parse_apkindex(APKINDEX)
+
+
+@pytest.fixture
+def mapped(index, tmp_path):
+    path = tmp_path / 'index.bin'
+    main.write_mapped_index(index, str(path))
+    with main.MappedIndex(str(path)) as mapped:
+        yield mapped
+
+
+def test_get_matches_index(index, mapped):
+    assert len(mapped) == 6
+    for name in index['packages']:
+        pkg_info = mapped.get(name)
+        assert pkg_info['name'] == name
+        assert pkg_info['version'] == index['packages'][name][-1]['version']
+    # Зависимости уже разрешены: provides -> пакет, без повторов
+    assert mapped.get('busybox')['depends'] == 'musl'
+    assert mapped.get('curl')['depends'] == 'busybox libcurl so:libmissing.so.1'
+    assert mapped.get('пакет')['version'] == '1.0-r0'
+
+
+def test_missing_names(mapped):
+    assert mapped.get('nothing') is None
+    assert mapped.find('nothing') is None
+    assert mapped.closure('nothing') is None
+    # Неразрешимая зависимость - вершина графа, но не пакет
+    assert mapped.find('so:libmissing.so.1') is not None
+    assert mapped.get('so:libmissing.so.1') is None
+
+
+def test_closure_and_graph(index, mapped):
+    assert mapped.closure('curl') == {'busybox': 1, 'libcurl': 1, 'so:libmissing.so.1': 1, 'musl': 2}
+    assert mapped.closure('musl') == {}
+
+    expected, _, expected_cycles = main.build_graph_bfs(
+        'curl', *main.make_package_lookups(index, 'curl'), quiet=True)
+    graph, _, cycles = main.build_graph_bfs('curl', mapped.get, quiet=True)
+    assert graph == expected
+    assert cycles == expected_cycles == [['curl', 'libcurl', 'curl']]
+
+
+def test_rejects_empty_truncated_and_foreign_files(index, tmp_path):
+    path = tmp_path / 'index.bin'
+    main.write_mapped_index(index, str(path))
+    data = path.read_bytes()
+
+    for name, content in [('empty', b''), ('header', data[:main.MAPPED_INDEX_HEADER.size]),
+                          ('truncated', data[:-1]), ('foreign', b'XXXX' + data[4:])]:
+        broken = tmp_path / name
+        broken.write_bytes(content)
+        with pytest.raises(ValueError):
+            main.MappedIndex(str(broken))
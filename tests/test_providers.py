@@ -0,0 +1,66 @@
+"""Разрешение виртуальных зависимостей (so:/cmd:/...) через provides.
+
+Из нескольких пакетов-поставщиков выбирается самая новая подходящая версия,
+при равных версиях - из более приоритетного репозитория.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+
+
+APKINDEX = """P:libcurl
+V:8.0-r0
+D:musl
+p:so:libcurl.so.4=4
+
+P:curl
+V:8.10-r0
+D:so:libcurl.so.4 musl
+
+P:libcurl
+V:8.10-r0
+D:musl zlib
+p:so:libcurl.so.4=4
+
+P:musl
+V:1.2.4-r2
+
+P:zlib
+V:1.3-r0
+"""
+
+
+def load(text, lazy):
+    return main.load_apkindex_lazy(text.encode()) if lazy else main.parse_apkindex(text)
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_newest_provider_wins(lazy):
+    index = load(APKINDEX, lazy)
+    assert main.resolve_dependency(index, 'so:libcurl.so.4')['version'] == '8.10-r0'
+
+    graph, _, _ = main.build_graph_bfs('curl', *main.make_package_lookups(index, 'curl'), quiet=True)
+    assert graph['curl'] == ['libcurl', 'musl']
+    assert graph['libcurl'] == ['musl', 'zlib']
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_provider_constraint_skips_newer(lazy):
+    text = APKINDEX.replace('8.10-r0\nD:musl zlib\np:so:libcurl.so.4=4', '8.10-r0\nD:musl zlib\np:so:libcurl.so.4=5')
+    index = load(text, lazy)
+    assert main.resolve_dependency(index, 'so:libcurl.so.4<5')['version'] == '8.0-r0'
+    assert main.resolve_dependency(index, 'so:libcurl.so.4>=5')['version'] == '8.10-r0'
+    assert main.resolve_dependency(index, 'so:libcurl.so.4>5') is None
+
+
+def test_equal_versions_prefer_repository_order():
+    main_repo = main.parse_apkindex("P:libfoo\nV:1.0-r0\nD:musl\np:so:libfoo.so.1=1\n")
+    testing = main.parse_apkindex("P:libfoo\nV:1.0-r0\nD:zlib\np:so:libfoo.so.1=1\n")
+    index = main.merge_indexes([main_repo, testing])
+    assert main.resolve_dependency(index, 'so:libfoo.so.1')['depends'] == 'musl'
+    index = main.merge_indexes([testing, main_repo])
+    assert main.resolve_dependency(index, 'so:libfoo.so.1')['depends'] == 'zlib'
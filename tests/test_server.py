@@ -0,0 +1,146 @@
+"""Режим сервера: запросы по HTTP, LRU-кэш ответов и его сброс при обновлении репозитория.
+
+Репозиторий - тестовый файл (repo_mode=test), сервер слушает случайный порт.
+"""
+import json
+import os
+import sys
+import threading
+import http.server
+import urllib.error
+import urllib.request
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+
+
+REPOSITORY = """A:B C
+B:D
+C:D
+D:
+E:F
+F:E
+"""
+
+
+@pytest.fixture
+def service(tmp_path):
+    path = tmp_path / 'repo.txt'
+    path.write_text(REPOSITORY, encoding='utf-8')
+    service = main.ResolverService([{'repository_url': str(path), 'repo_mode': 'test'}], cache_size=3)
+    service.load()
+    service.path = path
+    return service
+
+
+@pytest.fixture
+def server(service):
+    handler = type('Handler', (main.QueryHandler,), {'service': service})
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def get(url):
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def test_endpoints(server):
+    status, body = get(f"{server}/deps?package=A")
+    assert status == 200
+    assert body['count'] == 3
+    assert body['graph'] == {'A': ['B', 'C'], 'B': ['D'], 'C': ['D'], 'D': []}
+
+    status, body = get(f"{server}/rdeps?package=D")
+    assert status == 200
+    assert set(body['dependents']) >= {'B', 'C'}
+
+    status, body = get(f"{server}/order?package=A")
+    assert status == 200
+    assert body['order'][0] == 'D' and body['order'][-1] == 'A'
+    assert body['critical_path'][0] == 'A' and body['critical_path'][-1] == 'D'
+
+    status, body = get(f"{server}/cycles?package=E")
+    assert status == 200
+    assert sorted(body['cycles'][0][:2]) == ['E', 'F']
+
+    status, body = get(f"{server}/status")
+    assert status == 200
+    assert body['packages'] == [6]
+
+    assert get(f"{server}/deps?package=Z")[0] == 404
+    assert get(f"{server}/deps")[0] == 400
+    assert get(f"{server}/unknown?package=A")[0] == 404
+    assert get(f"{server}/deps?package=A&repo=5")[0] == 404
+
+
+def test_lru_evicts_oldest(service):
+    for name in ('A', 'B', 'C'):
+        service.query('deps', name)
+    service.query('deps', 'A')
+    service.query('deps', 'D')
+
+    packages = [key[2] for key in service.cache]
+    assert len(service.cache) == 3
+    assert packages == ['C', 'A', 'D']
+
+
+def test_refresh_invalidates_only_on_change(service):
+    service.query('deps', 'A')
+    service.refresh()
+    assert len(service.cache) == 1
+
+    service.path.write_text(REPOSITORY.replace('C:D', 'C:D E'), encoding='utf-8')
+    service.refresh()
+    assert len(service.cache) == 0
+    _, body = service.query('deps', 'A')
+    assert body['graph']['C'] == ['D', 'E']
+
+
+def test_answer_computed_during_refresh_is_not_cached(service):
+    repo = main.repository_key(service.configs[0])
+    key = ((repo, service.generations[repo]), 'deps', 'A', '')
+
+    def compute():
+        # Репозиторий обновился, пока считался ответ по старому индексу
+        service.path.write_text(REPOSITORY.replace('A:B C', 'A:B'), encoding='utf-8')
+        service.refresh()
+        return 'старый ответ'
+
+    assert service.cached(key, compute) == 'старый ответ'
+    assert service.cache == {}
+    _, body = service.query('deps', 'A')
+    assert body['graph']['A'] == ['B']
+
+
+def test_refresh_skips_diff_on_304(tmp_path, monkeypatch):
+    from test_http_cache import APKINDEX_V1, Server, write_apkindex
+
+    monkeypatch.setattr(main, 'CACHE_DIR', str(tmp_path / 'cache'))
+    (tmp_path / 'www' / 'x86_64').mkdir(parents=True)
+    write_apkindex(tmp_path / 'www' / 'x86_64' / 'APKINDEX.tar.gz', APKINDEX_V1, 1_700_000_000)
+    mirror = Server(str(tmp_path / 'www'))
+    try:
+        service = main.ResolverService([{'repository_url': mirror.url, 'repo_mode': 'http'}])
+        service.load()
+        index = service.indexes[main.repository_key(service.configs[0])]
+        service.query('deps', 'curl')
+
+        diffs = []
+        monkeypatch.setattr(main, 'diff_indexes', lambda old, new: diffs.append(1))
+        service.refresh()
+    finally:
+        mirror.stop()
+
+    assert mirror.statuses == [200, 304]
+    assert diffs == []
+    assert service.indexes[main.repository_key(service.configs[0])] is index
+    assert len(service.cache) == 1
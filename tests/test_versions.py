@@ -0,0 +1,86 @@
+"""Сравнение версий Alpine и выбор версии под ограничение.
+
+Порядок - как у apk-tools (apk version -t): сначала все числа, потом буква,
+суффиксы (_alpha < _beta < _pre < _rc < без суффикса < _cvs < _svn < _git < _hg < _p)
+и ревизия -rN.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+
+
+# Каждая версия меньше следующей
+ORDERED = [
+    ['1.2', '1.2.1', '1.10'],
+    ['1.0_alpha', '1.0_alpha1', '1.0_alpha2', '1.0_beta', '1.0_pre1', '1.0_rc1', '1.0', '1.0_cvs',
+     '1.0_svn', '1.0_git20240101', '1.0_hg', '1.0_p1', '1.0_p2'],
+    ['1.0', '1.0-r0', '1.0-r1', '1.0-r2', '1.0-r10'],
+    ['1.0', '1.0a', '1.0b', '1.0.1'],
+    ['1.0-r5', '1.0_p1', '1.0a', '1.0.0'],
+    ['1.0_rc1', '1.0_rc1-r3', '1.0_rc1_p1', '1.0_rc2', '1.0'],
+    ['8.1', '8.1.5', '8.2', '8.10'],
+    ['2.38.1-r0', '2.38.1-r1', '2.39-r0'],
+    ['не-версия', '0.1'],
+]
+
+
+@pytest.mark.parametrize('versions', ORDERED, ids=lambda versions: ' < '.join(versions))
+def test_order(versions):
+    for lower, higher in zip(versions, versions[1:]):
+        assert main.version_key(lower) < main.version_key(higher)
+        assert main.version_satisfies(higher, '>', lower)
+        assert not main.version_satisfies(lower, '>=', higher)
+    assert sorted(reversed(versions), key=main.version_key) == versions
+
+
+@pytest.mark.parametrize('version, op, required, expected', [
+    ('1.2.4-r2', '=', '1.2.4-r2', True),
+    ('1.2.4-r2', '=', '1.2.4', False),
+    ('1.2.4-r2', '>=', '1.2.4', True),
+    ('1.2.4-r2', '<', '1.2.5_rc1', True),
+    ('8.1.5', '~', '8.1', True),
+    ('8.1-r3', '~', '8.1', True),
+    ('8.1_rc1', '~', '8.1', True),
+    ('8.10', '~', '8.1', False),
+    ('8.1', '~', '8.10', False),
+    ('1.0', '', '', True),
+])
+def test_satisfies(version, op, required, expected):
+    assert main.version_satisfies(version, op, required) is expected
+
+
+CANDIDATES = ['8.0-r0', '8.1_rc1', '8.1-r0', '8.1.5-r0', '8.2-r0', '8.10-r0', '8.10-r1']
+
+
+@pytest.mark.parametrize('constraint, expected', [
+    ('', '8.10-r1'),
+    ('>=8.2', '8.10-r1'),
+    ('>8.10-r1', None),
+    ('<8.10', '8.2-r0'),
+    ('<=8.10-r0', '8.10-r0'),
+    ('<8.0', None),
+    ('=8.1-r0', '8.1-r0'),
+    ('=8.1', None),
+    ('~8.1', '8.1.5-r0'),
+    ('~8.10', '8.10-r1'),
+    ('~8.3', None),
+])
+def test_select_version(constraint, expected):
+    candidates = [main.PackageRecord('curl', version) for version in CANDIDATES]
+    candidates.sort(key=main.record_version_key)
+    op, version = main.parse_version_constraint(constraint) if constraint else ('', '')
+    selected = main.select_version(candidates, op, version)
+    assert (selected and selected['version']) == expected
+
+    # Бинарный поиск даёт то же, что и перебор всех версий
+    matching = [pkg for pkg in candidates if main.version_satisfies(pkg['version'], op, version)]
+    assert selected is (matching[-1] if matching else None)
+
+
+def test_select_prerelease_only():
+    candidates = [main.PackageRecord('curl', '8.1_rc1'), main.PackageRecord('curl', '8.1_rc2')]
+    assert main.select_version(candidates, '~', '8.1')['version'] == '8.1_rc2'